@@ -0,0 +1,69 @@
+import os
+import streamlit as st
+from metrics import get_llm_metrics, summarize
+from llm_cache import get_llm_cache
+
+def is_admin(username):
+    """Admins are the usernames listed (comma separated) in ADMIN_USERS"""
+    admins = {name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()}
+    return username in admins
+
+def cache_view():
+    """Display the shared response cache's size and hit rate"""
+    stats = get_llm_cache().stats()
+    lookups = stats["shared_hits"] + stats["shared_misses"]
+
+    st.subheader("Response cache")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Entries", stats["entries"])
+    col2.metric("Hit rate", f"{stats['shared_hits'] / lookups:.0%}" if lookups else "n/a")
+    col3.metric("Hits / misses", f"{stats['shared_hits']} / {stats['shared_misses']}")
+    col4.metric("Coalesced requests", stats["coalesced"])
+
+    st.caption(
+        f"Hits and misses are counted across every process sharing {get_llm_cache().path}; "
+        f"this process had {stats['hits']} hits and {stats['misses']} misses. Coalesced requests are counted per process."
+    )
+
+def metrics_view():
+    """Display LLM call latency and token usage per app function"""
+    if not is_admin(st.session_state.username):
+        st.error("This page is only available to admins.")
+        st.session_state.admin_view = False
+        return
+
+    st.title("LLM Metrics")
+
+    # Sidebar with back button
+    with st.sidebar:
+        if st.button("Back to Dashboard"):
+            st.session_state.admin_view = False
+            st.rerun()
+
+        limit = st.number_input("Recent calls to include", min_value=100, max_value=100000, value=10000, step=1000)
+        include_cached = st.checkbox("Include cached and coalesced calls", value=False)
+
+        if st.button("Clear response cache"):
+            get_llm_cache().clear()
+            st.success("Response cache cleared.")
+
+    cache_view()
+
+    records = get_llm_metrics().recent(int(limit))
+    if not include_cached:
+        records = [r for r in records if r["outcome"] not in ("cached", "coalesced")]
+
+    if not records:
+        st.info("No LLM calls have been recorded yet.")
+        return
+
+    st.subheader("Latency and token usage per function")
+    st.dataframe(summarize(records), use_container_width=True, hide_index=True)
+
+    st.caption(
+        f"Based on the last {len(records)} calls in {get_llm_metrics().log_path}. "
+        f"This process writes its Prometheus metrics to {get_llm_metrics().prom_path}."
+    )
+
+    st.subheader("Recent calls")
+    st.dataframe(list(reversed(records[-50:])), use_container_width=True, hide_index=True)
@@ -1,185 +1,66 @@
+import time
+# Taken before the imports so a profiled rerun can report what they cost
+_rerun_started = time.perf_counter()
 import os
+import copy
 import streamlit as st
-from datetime import datetime
-import json
-import openai
 from dotenv import load_dotenv
-import uuid
+from utils import (
+    check_credentials, register_user, get_user_spaces, find_user_spaces, get_space_by_id,
+    display_space_card, stream_chat_with_ai, stream_learning_content, create_learning_space,
+    find_cached_answer, warm_cached_answers, use_cached_answer, search_spaces, open_search_result, get_content_variant, save_content_variant, prefetch_content_variants,
+    ensure_space_generation, display_generation_progress, watch_generation, prefetch_recent_resources
+)
+from blobstore import load_space_field
+from chat_store import get_chat_store
+from sections import display_sections
+from quiz import quiz_view, prefetch_quiz
+from resources import resources_view
+from admin import is_admin, metrics_view
+from profiler import start_rerun, finish_rerun, current_profile, profile_targets
 
-# Load environment variables
-load_dotenv()
-
-# Configure OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-# Initialize session state variables if they don't exist
-if 'logged_in' not in st.session_state:
-    st.session_state.logged_in = False
-if 'username' not in st.session_state:
-    st.session_state.username = None
-if 'user_spaces' not in st.session_state:
-    st.session_state.user_spaces = {}
-if 'current_space' not in st.session_state:
-    st.session_state.current_space = None
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = {}
-if 'content_customization' not in st.session_state:
-    st.session_state.content_customization = {
+SESSION_DEFAULTS = {
+    'logged_in': False,
+    'username': None,
+    'user_spaces': {},
+    'current_space': None,
+    'space_view': None,
+    'chat_history': {},
+    'chat_pages': {},
+    'qa_offer': None,
+    'admin_view': False,
+    'dashboard_page': 0,
+    # (space id, time) of when the learner opened the space they are reading
+    'space_opened': (None, 0.0),
+    'content_customization': {
         'difficulty_level': 'Intermediate',
         'content_format': 'Mixed (Text, Images, Code)',
         'learning_style': 'Conceptual'
-    }
-
-# Load users from JSON file (or create it if it doesn't exist)
-def load_users():
-    try:
-        with open("users.json", "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Create default users file if it doesn't exist
-        default_users = {"admin": "password"}
-        with open("users.json", "w") as f:
-            json.dump(default_users, f)
-        return default_users
-
-# Save users to JSON file
-def save_users(users):
-    with open("users.json", "w") as f:
-        json.dump(users, f)
+    },
+}
 
-# Load user spaces from JSON file (or create it if it doesn't exist)
-def load_user_spaces():
-    try:
-        with open("user_spaces.json", "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Create empty spaces file if it doesn't exist
-        with open("user_spaces.json", "w") as f:
-            json.dump({}, f)
-        return {}
+# One-time initialization, shared by every rerun and session of this process
+@st.cache_resource(show_spinner=False)
+def load_environment():
+    # OPENAI_API_KEY and the other settings are read lazily by the shared clients and stores
+    load_dotenv()
 
-# Save user spaces to JSON file
-def save_user_spaces(spaces):
-    with open("user_spaces.json", "w") as f:
-        json.dump(spaces, f)
+load_environment()
+start_rerun(_rerun_started)
 
-# Chat with AI
-def chat_with_ai(message, space_topic, customization=None):
-    if not customization:
-        customization = st.session_state.content_customization
-    
-    # Prepare the message with customization settings
-    system_message = f"""
-    You are an expert tutor on the topic: {space_topic}.
-    Generate educational content with these preferences:
-    - Difficulty Level: {customization['difficulty_level']}
-    - Content Format: {customization['content_format']}
-    - Learning Style: {customization['learning_style']}
-    
-    Always provide accurate, well-structured explanations that are easy to understand.
-    """
-    
-    try:
-        messages = [
-            {"role": "system", "content": system_message},
-        ]
-        
-        # Add chat history for context
-        if space_topic in st.session_state.chat_history:
-            messages.extend(st.session_state.chat_history[space_topic][-5:])  # Last 5 messages for context
-        
-        # Add the new user message
-        messages.append({"role": "user", "content": message})
-        
-        # Get response from OpenAI
-        response = openai.chat.completions.create(
-            model="gpt-4",  # You can change this to your preferred model
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1500
-        )
-        
-        ai_response = response.choices[0].message.content
-        
-        # Update chat history
-        if space_topic not in st.session_state.chat_history:
-            st.session_state.chat_history[space_topic] = []
-        
-        st.session_state.chat_history[space_topic].append({"role": "user", "content": message})
-        st.session_state.chat_history[space_topic].append({"role": "assistant", "content": ai_response})
-        
-        return ai_response
-        
-    except Exception as e:
-        return f"Error communicating with AI: {str(e)}"
-
-# Generate learning content
-def generate_learning_content(topic, customization=None):
-    if not customization:
-        customization = st.session_state.content_customization
-    
-    prompt = f"""
-    Create a comprehensive introduction to {topic} with these specifications:
-    - Difficulty Level: {customization['difficulty_level']}
-    - Content Format: {customization['content_format']}
-    - Learning Style: {customization['learning_style']}
-    
-    Include:
-    1. A brief overview of {topic}
-    2. Key concepts to understand
-    3. Why this topic is important
-    4. How to approach learning this topic
-    5. A learning path or roadmap
-    
-    Format the response with proper Markdown formatting, including:
-    - Headers and subheaders
-    - Bullet points where appropriate
-    - Code examples if relevant
-    - Bold or italic text for emphasis
-    """
-    
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-4",  # You can change this to your preferred model
-            messages=[
-                {"role": "system", "content": "You are an educational content creator who specializes in creating engaging learning materials."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=2000
-        )
-        
-        return response.choices[0].message.content
-        
-    except Exception as e:
-        return f"Error generating content: {str(e)}"
+@st.cache_data(show_spinner=False)
+def load_css():
+    with open('style.css') as f:
+        return f'<style>{f.read()}</style>'
 
-# Create a new learning space
-def create_learning_space(username, topic):
-    user_spaces = load_user_spaces()
-    
-    if username not in user_spaces:
-        user_spaces[username] = []
-    
-    # Generate a unique ID for the space
-    space_id = str(uuid.uuid4())
-    
-    # Create the space
-    new_space = {
-        "id": space_id,
-        "topic": topic,
-        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "last_accessed": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "content": generate_learning_content(topic)
-    }
-    
-    user_spaces[username].append(new_space)
-    save_user_spaces(user_spaces)
-    
-    # Update session state
-    st.session_state.user_spaces = user_spaces
-    
-    return space_id
+def init_session_state():
+    """Fill in missing session state defaults, once per session"""
+    if st.session_state.get('session_initialized'):
+        return
+    for key, value in SESSION_DEFAULTS.items():
+        if key not in st.session_state:
+            st.session_state[key] = copy.deepcopy(value)
+    st.session_state.session_initialized = True
 
 # Login page
 def login_page():
@@ -192,15 +73,12 @@ def login_page():
         submitted = st.form_submit_button("Login")
         
         if submitted:
-            users = load_users()
-            if username in users and users[username] == password:
+            if check_credentials(username, password):
                 st.session_state.logged_in = True
                 st.session_state.username = username
                 
                 # Load user's spaces
-                user_spaces = load_user_spaces()
-                if username in user_spaces:
-                    st.session_state.user_spaces = user_spaces
+                st.session_state.user_spaces = {username: get_user_spaces(username)}
                 
                 st.success("Login successful!")
                 st.rerun()
@@ -219,18 +97,25 @@ def login_page():
             if register_submitted:
                 if new_password != confirm_password:
                     st.error("Passwords do not match")
+                elif not register_user(new_username, new_password):
+                    st.error("Username already exists")
                 else:
-                    users = load_users()
-                    if new_username in users:
-                        st.error("Username already exists")
-                    else:
-                        users[new_username] = new_password
-                        save_users(users)
-                        st.success("Registration successful! You can now log in.")
+                    st.success("Registration successful! You can now log in.")
+
+SORT_OPTIONS = {"Last accessed": "last_accessed", "Created": "created_at"}
+SEARCH_KIND_LABELS = {"content": "Content", "resources": "Resource", "quiz_questions": "Quiz question", "chat": "Chat"}
+
+def _reset_dashboard_page():
+    st.session_state.dashboard_page = 0
+
+def _move_dashboard_page(step):
+    st.session_state.dashboard_page += step
 
 # Dashboard page
 def dashboard_page():
     st.title(f"Welcome, {st.session_state.username}!")
+    # Reading time counts again from the next time a space is opened
+    st.session_state.space_opened = (None, 0.0)
     
     # Sidebar with logout button
     with st.sidebar:
@@ -238,6 +123,12 @@ def dashboard_page():
             st.session_state.logged_in = False
             st.session_state.username = None
             st.session_state.current_space = None
+            st.session_state.admin_view = False
+            st.session_state.dashboard_page = 0
+            st.rerun()
+        
+        if is_admin(st.session_state.username) and st.button("LLM Metrics"):
+            st.session_state.admin_view = True
             st.rerun()
     
     # Create a new learning space
@@ -247,62 +138,68 @@ def dashboard_page():
             submitted = st.form_submit_button("Create Space")
             
             if submitted and topic:
-                space_id = create_learning_space(st.session_state.username, topic)
-                st.session_state.current_space = space_id
+                # Returns straight away; the space fills in while it shows as generating below
+                create_learning_space(st.session_state.username, topic)
                 st.success(f"Created a new learning space for {topic}!")
                 st.rerun()
     
+    # Search inside every space
+    content_query = st.text_input("Search your content, resources, quizzes and chats")
+    if content_query:
+        start = time.perf_counter()
+        results = search_spaces(content_query)
+        st.caption(f"{len(results)} results in {(time.perf_counter() - start) * 1000:.0f} ms")
+        
+        for index, result in enumerate(results):
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                st.write(f"**{result['topic']}** · {SEARCH_KIND_LABELS[result['kind']]}: {result['title']}")
+                st.markdown(result['snippet'])
+            with col2:
+                st.button("Open", key=f"search_{index}", on_click=open_search_result, args=(result,))
+    
     # Display existing spaces
     st.subheader("Your Learning Spaces")
     
-    user_spaces = load_user_spaces()
-    if st.session_state.username in user_spaces and user_spaces[st.session_state.username]:
-        spaces = user_spaces[st.session_state.username]
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("Search topics", key="space_query", on_change=_reset_dashboard_page)
+    with col2:
+        sort = st.selectbox("Sort by", list(SORT_OPTIONS), key="space_sort", on_change=_reset_dashboard_page)
+    
+    # Only the cards on the current page are built
+    page_size = int(os.getenv("DASHBOARD_PAGE_SIZE", 10))
+    spaces, total = find_user_spaces(st.session_state.username, query, SORT_OPTIONS[sort], st.session_state.dashboard_page, page_size)
+    pages = max((total + page_size - 1) // page_size, 1)
+    if st.session_state.dashboard_page >= pages:
+        # Spaces were deleted from the last page
+        st.session_state.dashboard_page = pages - 1
+        spaces, total = find_user_spaces(st.session_state.username, query, SORT_OPTIONS[sort], pages - 1, page_size)
+    
+    if spaces:
+        offset = st.session_state.dashboard_page * page_size
+        for index, space in enumerate(spaces):
+            display_space_card(space, offset + index)
         
-        for space in spaces:
-            col1, col2, col3 = st.columns([3, 1, 1])
-            
+        if pages > 1:
+            col1, col2, col3 = st.columns([1, 2, 1])
             with col1:
-                st.write(f"**{space['topic']}**")
-                st.caption(f"Created: {space['created_at']}")
-            
+                st.button("Previous", disabled=st.session_state.dashboard_page == 0, on_click=_move_dashboard_page, args=(-1,))
             with col2:
-                if st.button("Learn", key=f"learn_{space['id']}"):
-                    st.session_state.current_space = space['id']
-                    # Update last accessed time
-                    for s in user_spaces[st.session_state.username]:
-                        if s['id'] == space['id']:
-                            s['last_accessed'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    save_user_spaces(user_spaces)
-                    st.rerun()
-            
+                st.caption(f"Page {st.session_state.dashboard_page + 1} of {pages} ({total} spaces)")
             with col3:
-                if st.button("Delete", key=f"delete_{space['id']}"):
-                    # Remove the space from user's spaces
-                    user_spaces[st.session_state.username] = [s for s in user_spaces[st.session_state.username] if s['id'] != space['id']]
-                    save_user_spaces(user_spaces)
-                    
-                    # Update session state
-                    st.session_state.user_spaces = user_spaces
-                    if st.session_state.current_space == space['id']:
-                        st.session_state.current_space = None
-                    
-                    st.rerun()
-            
-            st.divider()
+                st.button("Next", disabled=st.session_state.dashboard_page == pages - 1, on_click=_move_dashboard_page, args=(1,))
+        
+        watch_generation([space['id'] for space in spaces if space.get('status') == "pending"])
+        prefetch_recent_resources(st.session_state.username)
+    elif query:
+        st.info(f"No learning spaces match \"{query}\".")
     else:
         st.info("You don't have any learning spaces yet. Create one above to get started!")
 
 # Learning space page
 def learning_space_page(space_id):
-    user_spaces = load_user_spaces()
-    
-    # Find the space with the given ID
-    space = None
-    for s in user_spaces[st.session_state.username]:
-        if s['id'] == space_id:
-            space = s
-            break
+    space = get_space_by_id(space_id)
     
     if not space:
         st.error("Space not found!")
@@ -334,62 +231,145 @@ def learning_space_page(space_id):
         )
         
         # Apply button for customization
-        if st.button("Apply Customization"):
+        regenerate = st.button("Apply Customization")
+        if regenerate:
             st.session_state.content_customization = {
                 'difficulty_level': difficulty_level,
                 'content_format': content_format,
                 'learning_style': learning_style
             }
-            
-            # Regenerate content with new customization
-            space['content'] = generate_learning_content(space['topic'], st.session_state.content_customization)
-            
-            # Save updated space
-            for i, s in enumerate(user_spaces[st.session_state.username]):
-                if s['id'] == space_id:
-                    user_spaces[st.session_state.username][i] = space
-                    break
-            
-            save_user_spaces(user_spaces)
+        
+        st.subheader("Practice")
+        
+        if st.button("Take Quiz"):
+            st.session_state.space_view = "quiz"
+            st.rerun()
+        
+        if st.button("Learning Resources"):
+            st.session_state.space_view = "resources"
             st.rerun()
         
         if st.button("Back to Dashboard"):
             st.session_state.current_space = None
+            st.session_state.space_view = None
             st.rerun()
     
     # Main content
     st.title(f"Learning: {space['topic']}")
     
-    # Display generated content
-    st.markdown(space['content'])
+    if st.session_state.space_opened[0] != space_id:
+        st.session_state.space_opened = (space_id, time.time())
+    if not space.get('has_quiz'):
+        prefetch_quiz_after_reading(space_id)
+    prefetch_recent_resources(st.session_state.username)
+    
+    # Display generated content, streaming it in when it is being regenerated
+    variant = get_content_variant(space, st.session_state.content_customization) if regenerate else None
+    if variant is not None:
+        # These settings were used before in this space, so switch without generating
+        st.markdown(variant)
+        save_content_variant(space_id, st.session_state.content_customization)
+    elif regenerate:
+        try:
+            content = st.write_stream(stream_learning_content(space['topic'], st.session_state.content_customization))
+        except Exception as e:
+            # Keep the previous content rather than saving a partial answer
+            st.error(f"Error generating content: {str(e)}")
+        else:
+            # Save updated space once the stream has finished
+            space['content'] = content
+            save_content_variant(space_id, st.session_state.content_customization, content)
+    elif load_space_field(space, 'content') is not None:
+        display_sections(load_space_field(space, 'content'), space_id)
+        prefetch_content_variants(space)
+    elif 'content' in space.get('failed_fields', []):
+        st.error("Failed to generate learning content. Use Apply Customization to try again.")
+    else:
+        st.info("Your learning content is still being generated.")
+        ensure_space_generation(space, ['content'])
+        display_generation_progress(space)
+        watch_generation([space_id])
     
     # Chat interface
+    chat_panel(space_id, space['topic'])
+
+@st.fragment(run_every=5)
+def prefetch_quiz_after_reading(space_id):
+    """Start preparing the quiz once the learner has been reading this space for PREFETCH_QUIZ_AFTER seconds"""
+    opened_space, opened_at = st.session_state.space_opened
+    if opened_space != space_id or time.time() - opened_at < float(os.getenv("PREFETCH_QUIZ_AFTER", 20)):
+        return
+    
+    space = get_space_by_id(space_id)
+    if space:
+        prefetch_quiz(space)
+
+@st.fragment
+def chat_panel(space_id, topic):
+    """Question box and chat history; sending a question reruns only this part of the page"""
     st.subheader("Ask Questions")
+    warm_cached_answers(topic)
     
-    # Input for user questions
-    user_question = st.text_input("Type your question here...", key="user_question")
+    # Input for user questions, cleared by the form once it is sent
+    with st.form("question_form", clear_on_submit=True):
+        user_question = st.text_input("Type your question here...")
+        send = st.form_submit_button("Send")
     
-    if st.button("Send"):
+    if send:
         if user_question:
             # Display user question
             with st.chat_message("user"):
                 st.write(user_question)
             
-            # Get AI response
-            ai_response = chat_with_ai(user_question, space['topic'])
-            
-            # Display AI response
-            with st.chat_message("assistant"):
-                st.markdown(ai_response)
-            
-            # Clear the input field
-            st.session_state.user_question = ""
+            cached = find_cached_answer(user_question, topic)
+            if cached and cached['auto']:
+                # The same question was answered before, so reuse that answer
+                with st.chat_message("assistant"):
+                    st.markdown(cached['answer'])
+                    st.caption(f"Answered from an earlier question: \"{cached['question']}\"")
+                use_cached_answer(user_question, topic, cached['answer'], space_id)
+            elif cached:
+                # Close enough to offer, but let the student decide
+                st.session_state.qa_offer = {"space_id": space_id, "asked": user_question, "match": cached}
+            else:
+                # Stream the AI response as it is generated
+                with st.chat_message("assistant"):
+                    st.write_stream(stream_chat_with_ai(user_question, topic, space_id=space_id))
+    
+    # Offer a stored answer to a similar question
+    offer = st.session_state.qa_offer
+    if offer and offer['space_id'] == space_id:
+        with st.chat_message("assistant"):
+            st.caption(f"A similar question was answered before: \"{offer['match']['question']}\"")
+            st.markdown(offer['match']['answer'])
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Use this answer"):
+                use_cached_answer(offer['asked'], topic, offer['match']['answer'], space_id)
+                st.session_state.qa_offer = None
+                st.rerun(scope="fragment")
+        with col2:
+            if st.button("Ask the tutor anyway"):
+                st.session_state.qa_offer = None
+                with st.chat_message("assistant"):
+                    st.write_stream(stream_chat_with_ai(offer['asked'], topic, space_id=space_id))
+    
+    # Display chat history, newest page only until older pages are asked for
+    chat_store = get_chat_store()
+    total_messages = chat_store.count(space_id)
     
-    # Display chat history
-    if space['topic'] in st.session_state.chat_history:
+    if total_messages:
         st.subheader("Chat History")
         
-        for message in st.session_state.chat_history[space['topic']]:
+        page_size = int(os.getenv("CHAT_PAGE_SIZE", 20))
+        shown = st.session_state.chat_pages.get(space_id, 1) * page_size
+        
+        if total_messages > shown and st.button("Load older messages"):
+            st.session_state.chat_pages[space_id] = shown // page_size + 1
+            st.rerun(scope="fragment")
+        
+        for message in chat_store.latest(space_id, shown):
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
 
@@ -402,9 +382,10 @@ def main():
         initial_sidebar_state="expanded"
     )
     
+    init_session_state()
+    
     # Load custom CSS
-    with open('style.css') as f:
-        st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+    st.markdown(load_css(), unsafe_allow_html=True)
     
     # Check if user is logged in
     if not st.session_state.logged_in:
@@ -412,9 +393,42 @@ def main():
     else:
         # Check if a space is selected
         if st.session_state.current_space:
-            learning_space_page(st.session_state.current_space)
+            if st.session_state.space_view == "quiz":
+                quiz_view(st.session_state.current_space)
+            elif st.session_state.space_view == "resources":
+                resources_view(st.session_state.current_space)
+            else:
+                learning_space_page(st.session_state.current_space)
+        elif st.session_state.admin_view:
+            metrics_view()
         else:
             dashboard_page()
+    
+    if current_profile() is not None and "sidebar" in profile_targets():
+        display_rerun_profile()
+
+def display_rerun_profile():
+    """Show where this rerun's time went at the bottom of the sidebar"""
+    breakdown = current_profile().breakdown()
+    with st.sidebar:
+        with st.expander(f"Rerun profile: {breakdown['total_ms']:.0f} ms"):
+            st.dataframe(
+                [{"phase": phase, **timing} for phase, timing in breakdown['phases'].items()],
+                use_container_width=True,
+                hide_index=True
+            )
+
+def current_page():
+    """Name of the page being shown, for the rerun profile log"""
+    if not st.session_state.get('logged_in'):
+        return "login"
+    if st.session_state.current_space:
+        return st.session_state.space_view or "content"
+    return "metrics" if st.session_state.admin_view else "dashboard"
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Also runs when the page stops early for st.rerun()
+        finish_rerun(current_page())
@@ -0,0 +1,322 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from types import SimpleNamespace
+import numpy as np
+
+# Offline microbenchmarks for the storage and generation hot paths
+#
+# Each case builds a synthetic user_spaces.json (and, for the SQLite backend,
+# migrates it into a fresh database) in a temporary directory, points every
+# store at that directory and times the utils.py functions the app calls on
+# every page. OpenAI is replaced by a stub that answers instantly with
+# realistically sized content, so no network access or API key is needed.
+#
+#   python benchmark.py --users 1000 10000 --output bench.json
+#   python benchmark.py --baseline bench.json   # exits 1 on a regression
+
+DEFAULT_USER_COUNTS = (1000, 10000)
+DEFAULT_SPACES_PER_USER = 3
+DEFAULT_THRESHOLD = 0.25
+TOPICS = [
+    "Python", "Machine Learning", "Linear Algebra", "World War II", "Organic Chemistry", "Spanish",
+    "Music Theory", "Statistics", "JavaScript", "Photosynthesis", "Microeconomics", "Calculus",
+]
+
+def _paragraphs(rng, words):
+    vocabulary = "learning concept example practice model function data system value process theory result".split()
+    return " ".join(rng.choice(vocabulary) for _ in range(words))
+
+def fake_content(rng, topic):
+    """Markdown of roughly the size the content prompt produces (about 6 KB)"""
+    sections = [f"# Introduction to {topic}"]
+    for title in ("Overview", "Key Concepts", "Why It Matters", "How to Approach It", "Learning Path"):
+        sections.append(f"## {title}\n\n{_paragraphs(rng, 160)}")
+    return "\n\n".join(sections)
+
+def fake_resources(rng, topic):
+    def items(keys):
+        return [{key: f"{topic} {_paragraphs(rng, 6 if key == 'description' else 2)}" for key in keys} for _ in range(3)]
+    return {
+        "books": items(("title", "author", "description")),
+        "courses": items(("platform", "title", "link", "description")),
+        "videos": items(("channel", "title", "description")),
+        "websites": items(("name", "description")),
+        "communities": items(("name", "description")),
+    }
+
+def fake_quiz(rng, topic, num_questions=5):
+    return [
+        {
+            "question": f"{_paragraphs(rng, 12)} about {topic}?",
+            "options": [f"{letter}. {_paragraphs(rng, 5)}" for letter in "ABCD"],
+            "answer": rng.choice("ABCD"),
+            "explanation": _paragraphs(rng, 30),
+        }
+        for _ in range(num_questions)
+    ]
+
+class _StubCompletions:
+    """Answers chat.completions.create instantly, like OpenAI would for the app's prompts"""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+
+    def _text(self, params):
+        prompt = params["messages"][-1]["content"]
+        topic = self.rng.choice(TOPICS)
+        if params.get("response_format", {}).get("type") == "json_object":
+            if "quiz" in prompt:
+                return json.dumps({"questions": fake_quiz(self.rng, topic)})
+            return json.dumps(fake_resources(self.rng, topic))
+        return fake_content(self.rng, topic)
+
+    def create(self, **params):
+        text = self._text(params)
+        usage = SimpleNamespace(prompt_tokens=200, completion_tokens=len(text) // 4)
+        if not params.get("stream"):
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 64]))], usage=None)
+                  for i in range(0, len(text), 64)]
+        return iter(chunks + [SimpleNamespace(choices=[], usage=usage)])
+
+def write_dataset(directory, users, spaces_per_user, inline, seed):
+    """Write users.json, user_spaces.json and the blobs they refer to; returns {username: [space ids]}"""
+    from blobstore import BlobStore, HEAVY_FIELDS
+
+    rng = random.Random(seed)
+    blob_store = BlobStore(os.path.join(directory, "blobs"))
+
+    # Popular topics share their generated content, so a small pool of blobs covers every space
+    pool = []
+    for topic in TOPICS:
+        artifacts = {
+            "content": fake_content(rng, topic),
+            "resources": fake_resources(rng, topic),
+            "quiz_questions": fake_quiz(rng, topic),
+        }
+        refs = {f"{field}_ref": blob_store.put(artifacts[field]) for field in HEAVY_FIELDS}
+        pool.append((topic, artifacts, refs))
+
+    spaces = {}
+    for user in range(users):
+        username = f"user{user:06d}"
+        spaces[username] = []
+        for _ in range(rng.randint(1, 2 * spaces_per_user - 1)):
+            topic, artifacts, refs = rng.choice(pool)
+            space = {
+                "id": f"{user:06d}-{rng.getrandbits(64):016x}",
+                "topic": topic,
+                "created_at": "2025-01-01 12:00:00",
+                "last_accessed": "2025-01-02 12:00:00",
+                "has_quiz": True,
+                "status": "ready",
+            }
+            space.update(artifacts if inline else refs)
+            spaces[username].append(space)
+
+    with open(os.path.join(directory, "users.json"), "w") as f:
+        json.dump({username: "password" for username in spaces}, f)
+    with open(os.path.join(directory, "user_spaces.json"), "w") as f:
+        json.dump(spaces, f)
+
+    return {username: [space["id"] for space in user_spaces] for username, user_spaces in spaces.items()}
+
+def configure(directory, backend):
+    """Point every store at the case directory and drop the process-wide instances"""
+    import storage, blobstore, llm_cache, llm_client, metrics, chat_store, qa_cache, jobs, search_index, question_bank
+
+    if storage._storage is not None:
+        storage._storage.access_buffer.flush()
+
+    os.environ.update({
+        "STORAGE_BACKEND": backend,
+        "STORAGE_PATH": os.path.join(directory, "learning_tool.sqlite"),
+        "USERS_PATH": os.path.join(directory, "users.json"),
+        "USER_SPACES_PATH": os.path.join(directory, "user_spaces.json"),
+        "BLOB_DIR": os.path.join(directory, "blobs"),
+        "LLM_CACHE_PATH": os.path.join(directory, "llm_cache.sqlite"),
+        "METRICS_LOG_PATH": os.path.join(directory, "llm_metrics.jsonl"),
+        "METRICS_PROM_PATH": os.path.join(directory, "llm_metrics.prom"),
+        "CHAT_DB_PATH": os.path.join(directory, "chat_history.sqlite"),
+        "QA_CACHE_PATH": os.path.join(directory, "qa_cache.sqlite"),
+        "SEARCH_DB_PATH": os.path.join(directory, "search_index.sqlite"),
+        "QUESTION_BANK_PATH": os.path.join(directory, "question_bank.sqlite"),
+    })
+    storage._storage = None
+    blobstore._store = None
+    llm_cache._cache = None
+    metrics._metrics = None
+    chat_store._store = None
+    qa_cache._cache = None
+    jobs._queue = None
+    search_index._index = None
+    question_bank._bank = None
+
+    # Limits are lifted so the stub measures the app's own overhead, not the rate limiter
+    client = llm_client.LLMClient(api_key="benchmark", rpm=10 ** 9, tpm=10 ** 12)
+    client._client = SimpleNamespace(chat=SimpleNamespace(completions=_StubCompletions(0)))
+    llm_client._client = client
+
+def _session(username):
+    import streamlit as st
+    st.session_state.username = username
+    st.session_state.current_space = None
+    st.session_state.space_view = None
+    st.session_state.content_customization = {
+        'difficulty_level': 'Intermediate',
+        'content_format': 'Mixed (Text, Images, Code)',
+        'learning_style': 'Conceptual'
+    }
+
+def _time(fn, repeat):
+    """Call fn() repeat times; fn may return a callable to time instead (after untimed setup)"""
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = fn(i)
+        if callable(result):
+            start = time.perf_counter()
+            result()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def run_case(backend, users, args):
+    """Benchmark every operation on one synthetic dataset and return the result rows"""
+    import utils
+    from storage import get_storage
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(prefix="learning-tool-bench-") as directory:
+        ids = write_dataset(directory, users, args.spaces_per_user, args.inline, args.seed)
+        configure(directory, backend)
+        # Any one-off JSON to SQLite migration happens here, outside the timings
+        get_storage()
+
+        usernames = list(ids)
+        picks = [(username, rng.choice(ids[username])) for username in rng.sample(usernames, min(args.ops, len(usernames)))]
+        spaces = utils.load_user_spaces()
+
+        def get_space(i):
+            username, space_id = picks[i % len(picks)]
+            _session(username)
+            return lambda: utils.get_space_by_id(space_id)
+
+        def update(i):
+            username, space_id = picks[i % len(picks)]
+            _session(username)
+            space = utils.get_space_by_id(space_id)
+            space["last_accessed"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            return lambda: utils.update_space(space)
+
+        def create(i):
+            username = usernames[i % len(usernames)]
+            _session(username)
+            # A fresh topic each time so every generation misses the response cache
+            def run():
+                space_id = utils.create_learning_space(username, f"Benchmark topic {i}", include_quiz=True)
+                # Time until the space is ready, not just until it is queued
+                while utils.get_job_queue().is_active(space_id):
+                    time.sleep(0.001)
+            return run
+
+        def delete(i):
+            username, space_id = picks[i % len(picks)]
+            _session(username)
+            return lambda: utils.delete_space(space_id)
+
+        operations = [
+            ("load_user_spaces", lambda i: utils.load_user_spaces(), args.repeat),
+            ("save_user_spaces", lambda i: utils.save_user_spaces(spaces), args.repeat),
+            ("get_space_by_id", get_space, args.ops),
+            ("update_space", update, args.ops),
+            ("create_learning_space", create, args.creates),
+            # Last, since it removes the spaces the other operations pick from
+            ("delete_space", delete, min(args.ops, len(picks))),
+        ]
+
+        rows = []
+        for name, fn, repeat in operations:
+            samples = np.array(_time(fn, repeat))
+            rows.append({
+                "name": f"{backend}/{users}/{name}",
+                "backend": backend,
+                "users": users,
+                "operation": name,
+                "runs": repeat,
+                "mean_ms": round(float(samples.mean()), 4),
+                "p50_ms": round(float(np.percentile(samples, 50)), 4),
+                "p95_ms": round(float(np.percentile(samples, 95)), 4),
+                "min_ms": round(float(samples.min()), 4),
+            })
+            print(f"{rows[-1]['name']:<45} p50 {rows[-1]['p50_ms']:>10.3f} ms   p95 {rows[-1]['p95_ms']:>10.3f} ms", flush=True)
+
+        get_storage().access_buffer.flush()
+    return rows
+
+def compare(results, baseline, threshold):
+    """Return (name, baseline p50, current p50, ratio) for every case slower than the threshold allows"""
+    previous = {row["name"]: row for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        before = previous.get(row["name"])
+        if before is None or before["p50_ms"] <= 0:
+            continue
+        ratio = row["p50_ms"] / before["p50_ms"]
+        if ratio > 1 + threshold:
+            regressions.append((row["name"], before["p50_ms"], row["p50_ms"], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the learning tool's storage and generation paths")
+    parser.add_argument("--users", type=int, nargs="+", default=list(DEFAULT_USER_COUNTS), help="dataset sizes to run")
+    parser.add_argument("--backend", choices=["json", "sqlite", "both"], default="both")
+    parser.add_argument("--spaces-per-user", type=int, default=DEFAULT_SPACES_PER_USER, help="average spaces per user")
+    parser.add_argument("--inline", action="store_true", help="keep content inline in user_spaces.json (pre blob store layout)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of the whole-dataset load and save")
+    parser.add_argument("--ops", type=int, default=200, help="runs of the per-space operations")
+    parser.add_argument("--creates", type=int, default=20, help="runs of create_learning_space")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the results")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed p50 slowdown before failing")
+    args = parser.parse_args()
+
+    # The app functions run outside `streamlit run` here, where every session_state access logs a warning
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")
+
+    backends = ["json", "sqlite"] if args.backend == "both" else [args.backend]
+    results = []
+    for backend in backends:
+        for users in args.users:
+            results.extend(run_case(backend, users, args))
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: p50 {before:.3f} ms -> {after:.3f} ms ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
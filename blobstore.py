@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from functools import lru_cache
+from profiler import profiled
+
+# Content-addressed store for the heavy parts of a learning space
+#
+# Generated content, resources and quiz questions are written once under the
+# SHA-256 of their JSON encoding, so identical generations (the same popular
+# topic created by many users) share a single file. Spaces only keep the
+# hashes in "<field>_ref" keys and the views load the blobs when opened.
+
+DEFAULT_BLOB_DIR = "blobs"
+# gc keeps blobs written this recently, since a generation may have stored one
+# whose space record has not been saved yet
+DEFAULT_GC_GRACE_SECONDS = 60 * 60
+HEAVY_FIELDS = ("content", "resources", "quiz_questions")
+
+class BlobStore:
+    """Immutable JSON blobs stored on disk by content hash"""
+
+    def __init__(self, root=DEFAULT_BLOB_DIR):
+        self.root = root
+        # Blobs never change once written, so reads can be memoized safely
+        self._read = lru_cache(maxsize=256)(self._read_uncached)
+
+    def _path(self, blob_hash):
+        return os.path.join(self.root, blob_hash[:2], f"{blob_hash}.json")
+
+    @profiled("storage")
+    def put(self, value):
+        """Store a JSON-serializable value and return its hash"""
+        data = json.dumps(value, sort_keys=True)
+        blob_hash = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        path = self._path(blob_hash)
+
+        try:
+            # A reused blob counts as newly written, so gc's grace period covers it too
+            os.utime(path)
+            return blob_hash
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return blob_hash
+
+    def _read_uncached(self, blob_hash):
+        with open(self._path(blob_hash), "r") as f:
+            return f.read()
+
+    @profiled("storage")
+    def get(self, blob_hash):
+        """Load the value stored under a hash"""
+        # Parse on every call so callers never share mutable lists or dicts
+        return json.loads(self._read(blob_hash))
+
+    def hashes(self, written_before=None):
+        """Yield the hash of every stored blob, or only of those last written before a timestamp"""
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.listdir(self.root):
+            for name in os.listdir(os.path.join(self.root, prefix)):
+                if not name.endswith(".json"):
+                    continue
+                if written_before is not None:
+                    try:
+                        if os.path.getmtime(os.path.join(self.root, prefix, name)) >= written_before:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                yield name[:-len(".json")]
+
+    def delete(self, blob_hash):
+        try:
+            os.remove(self._path(blob_hash))
+        except FileNotFoundError:
+            pass
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_blob_store():
+    """Return the process-wide blob store rooted at BLOB_DIR"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BlobStore(os.getenv("BLOB_DIR", DEFAULT_BLOB_DIR))
+        return _store
+
+def pack_space(space):
+    """Return a copy of a space with its heavy fields moved into the blob store"""
+    packed = dict(space)
+    for field in HEAVY_FIELDS:
+        if field in packed:
+            packed[f"{field}_ref"] = get_blob_store().put(packed.pop(field))
+    return packed
+
+def load_space_field(space, field, default=None):
+    """Get a heavy field of a space, loading it from the blob store on first access"""
+    if field in space:
+        return space[field]
+
+    blob_hash = space.get(f"{field}_ref")
+    if blob_hash is None:
+        return default
+
+    space[field] = get_blob_store().get(blob_hash)
+    return space[field]
+
+if __name__ == "__main__":
+    if sys.argv[1:] not in (["migrate"], ["gc"]):
+        print("Usage: python blobstore.py migrate|gc")
+        sys.exit(1)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    from storage import get_storage
+    storage = get_storage()
+    # Taken before the spaces are read, so anything stored while gc runs is recent enough to keep
+    cutoff = time.time() - float(os.getenv("BLOB_GC_GRACE_SECONDS", DEFAULT_GC_GRACE_SECONDS))
+    spaces = storage.load_spaces()
+
+    if sys.argv[1] == "migrate":
+        # Move inline content of existing spaces into the blob store
+        storage.save_spaces({username: [pack_space(s) for s in user_spaces] for username, user_spaces in spaces.items()})
+        print(f"Packed {sum(len(s) for s in spaces.values())} spaces")
+    else:
+        # Remove blobs that no space refers to any more
+        referenced = {
+            space[f"{field}_ref"]
+            for user_spaces in spaces.values()
+            for space in user_spaces
+            for field in HEAVY_FIELDS
+            if f"{field}_ref" in space
+        }
+        # Earlier customizations of a space's content are kept too
+        referenced.update(
+            ref
+            for user_spaces in spaces.values()
+            for space in user_spaces
+            for ref in space.get("content_variants", {}).values()
+        )
+        store = get_blob_store()
+        unused = [blob_hash for blob_hash in store.hashes(cutoff) if blob_hash not in referenced]
+        for blob_hash in unused:
+            store.delete(blob_hash)
+        print(f"Removed {len(unused)} unreferenced blobs")
@@ -0,0 +1,76 @@
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Token-budgeted chat context
+#
+# Instead of a fixed number of raw messages, the tutor gets as many of the
+# newest whole turns as fit in a token budget. Turns that fall out of the
+# window are folded into a rolling summary, which is only recomputed when new
+# turns drop out, so long sessions keep a bounded prompt.
+
+DEFAULT_CONTEXT_TOKENS = 2000
+MESSAGE_OVERHEAD_TOKENS = 4
+
+@lru_cache(maxsize=8)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text, model="gpt-4"):
+    """Count tokens locally, with tiktoken when it is installed"""
+    if tiktoken is None:
+        # Roughly four characters per token for English text
+        return len(text) // 4 + 1
+    return len(_encoding(model).encode(text))
+
+def message_tokens(message, model="gpt-4"):
+    return count_tokens(message["content"], model) + MESSAGE_OVERHEAD_TOKENS
+
+def _turn_starts(history):
+    """Indexes where a turn begins: every user message, plus the start of the history"""
+    return [i for i, message in enumerate(history) if i == 0 or message["role"] == "user"]
+
+def build_chat_context(history, summary_state, summarize, budget=DEFAULT_CONTEXT_TOKENS, model="gpt-4", offset=0):
+    """Return the context messages for the next question
+
+    history is the list of chat messages, starting at position offset of the
+    whole conversation (callers with a persistent store only load what the
+    summary does not cover yet). summary_state is a dict kept by the caller
+    between calls ({"covered": n, "summary": text}) recording how many leading
+    messages the summary already covers. summarize(summary, messages) returns
+    an updated summary that includes the given messages.
+    """
+    # Take whole turns from the newest backwards until the budget is spent
+    start = len(history)
+    used = count_tokens(summary_state.get("summary", ""), model)
+    for turn_start in reversed(_turn_starts(history)):
+        turn_tokens = sum(message_tokens(m, model) for m in history[turn_start:start])
+        if used + turn_tokens > budget:
+            break
+        used += turn_tokens
+        start = turn_start
+
+    # Fold turns that have just fallen out of the window into the summary
+    covered = max(summary_state.get("covered", 0) - offset, 0)
+    if start > covered:
+        try:
+            summary_state["summary"] = summarize(summary_state.get("summary", ""), history[covered:start])
+            summary_state["covered"] = start + offset
+        except Exception:
+            # Try again on the next question; this one goes out without those turns
+            pass
+
+    messages = []
+    if summary_state.get("summary"):
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {summary_state['summary']}"})
+
+    # Never repeat turns that the summary already covers
+    messages.extend(history[max(start, summary_state.get("covered", 0) - offset):])
+
+    return messages
@@ -0,0 +1,107 @@
+import os
+import time
+import threading
+from profiler import profiled
+from sqlite_store import SQLiteStore
+
+# Persistent chat history
+#
+# Chat turns are appended per space id to an SQLite table keyed by
+# (space_id, seq), so the newest page or any older page is an index range scan
+# and nothing has to be held in session state. The rolling context summary
+# (see chat_context.py) is stored alongside so it survives restarts too.
+
+DEFAULT_CHAT_DB_PATH = "chat_history.sqlite"
+
+class ChatStore(SQLiteStore):
+    """Append-only chat messages per learning space"""
+
+    def __init__(self, path=DEFAULT_CHAT_DB_PATH):
+        super().__init__(path)
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    space_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (space_id, seq)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS summaries (
+                    space_id TEXT PRIMARY KEY,
+                    covered INTEGER NOT NULL,
+                    summary TEXT NOT NULL
+                )
+            """)
+
+    @profiled("storage")
+    def append_turn(self, space_id, question, answer):
+        """Append a question and its answer as the next two messages; returns the question's position"""
+        now = time.time()
+        with self._connect() as conn:
+            # Take the write lock before reading the next position so concurrent appends never pick the same one
+            conn.execute("BEGIN IMMEDIATE")
+            seq = conn.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE space_id = ?", (space_id,)).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO messages (space_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(space_id, seq, "user", question, now), (space_id, seq + 1, "assistant", answer, now)]
+            )
+        return seq
+
+    @profiled("storage")
+    def count(self, space_id):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM messages WHERE space_id = ?", (space_id,)).fetchone()[0]
+
+    @profiled("storage")
+    def latest(self, space_id, limit):
+        """Return the newest messages, oldest first"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content FROM messages WHERE space_id = ? ORDER BY seq DESC LIMIT ?",
+                (space_id, limit)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    @profiled("storage")
+    def messages_from(self, space_id, seq):
+        """Return every message from position seq onwards, oldest first"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT role, content FROM messages WHERE space_id = ? AND seq >= ? ORDER BY seq",
+                (space_id, seq)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    @profiled("storage")
+    def get_summary(self, space_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT covered, summary FROM summaries WHERE space_id = ?", (space_id,)).fetchone()
+        return {"covered": row[0], "summary": row[1]} if row else {"covered": 0, "summary": ""}
+
+    def save_summary(self, space_id, summary_state):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (space_id, covered, summary) VALUES (?, ?, ?)",
+                (space_id, summary_state["covered"], summary_state["summary"])
+            )
+
+    def delete_space(self, space_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE space_id = ?", (space_id,))
+            conn.execute("DELETE FROM summaries WHERE space_id = ?", (space_id,))
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_chat_store():
+    """Return the process-wide chat store at CHAT_DB_PATH"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChatStore(os.getenv("CHAT_DB_PATH", DEFAULT_CHAT_DB_PATH))
+        return _store
@@ -0,0 +1,40 @@
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Cross-process file locks
+#
+# Several Streamlit processes can share one data directory, so files that are
+# appended to or rotated by more than one of them are guarded by an exclusive
+# lock on a sidecar "<path>.lock" file (flock on POSIX, msvcrt.locking on
+# Windows). The lock is held by the process for the length of the with block.
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path + ".lock" for the duration of the with block"""
+    with open(f"{path}.lock", "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after about 10 seconds; keep waiting
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
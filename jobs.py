@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Background generation queue
+#
+# Expensive LLM generations run on a bounded pool of worker threads instead of
+# inside the Streamlit script, so a rerun never waits on them and at most
+# GENERATION_WORKERS generations run at once in this process. Tasks are grouped
+# into jobs (one per learning space) so the UI can show per-space progress.
+# Partial results of a running task are kept here in memory until it finishes,
+# so only the final result is ever saved.
+
+DEFAULT_WORKERS = 4
+
+class JobQueue:
+    """Bounded worker pool running named tasks grouped by job id"""
+
+    def __init__(self, max_workers=DEFAULT_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, tasks, on_result):
+        """Queue {name: callable} tasks for a job, skipping any already queued, and return the names queued
+
+        on_result(name, result, error) is called from the worker thread once
+        each task finishes. Calls for the same job never overlap, so it can
+        safely read-modify-write the job's stored record.
+        """
+        with self._lock:
+            job = self._jobs.setdefault(job_id, {"tasks": set(), "total": 0, "done": 0, "updates": 0, "partials": {}, "lock": threading.Lock()})
+            new_tasks = {name: task for name, task in tasks.items() if name not in job["tasks"]}
+            job["tasks"].update(new_tasks)
+            job["total"] += len(new_tasks)
+
+        for name, task in new_tasks.items():
+            self._executor.submit(self._run, job_id, job, name, task, on_result)
+        return list(new_tasks)
+
+    def _run(self, job_id, job, name, task, on_result):
+        result, error = None, None
+        try:
+            result = task()
+        except Exception as e:
+            error = e
+
+        with job["lock"]:
+            try:
+                on_result(name, result, error)
+            except Exception as e:
+                print(f"Error saving generated {name} for {job_id}: {str(e)}", file=sys.stderr)
+
+        with self._lock:
+            job["tasks"].discard(name)
+            job["partials"].pop(name, None)
+            job["done"] += 1
+            if not job["tasks"] and self._jobs.get(job_id) is job:
+                del self._jobs[job_id]
+
+    def is_active(self, job_id):
+        with self._lock:
+            return job_id in self._jobs
+
+    def is_queued(self, job_id, name):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job is not None and name in job["tasks"]
+
+    def progress(self, job_id):
+        """Return (done, total) for an active job, or None if nothing is queued"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return (job["done"], job["total"]) if job else None
+
+    def notify(self, job_id, name, partial):
+        """Record the partial result of a running task"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and name in job["tasks"]:
+                job["partials"][name] = partial
+                job["updates"] += 1
+
+    def partial(self, job_id, name):
+        """Return the latest partial result of a running task, or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job["partials"].get(name) if job else None
+
+    def version(self, job_id):
+        """Return a value that changes whenever the job makes progress, or None if nothing is queued"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return (job["done"], job["total"], job["updates"]) if job else None
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Return the process-wide generation queue sized by GENERATION_WORKERS"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(int(os.getenv("GENERATION_WORKERS", DEFAULT_WORKERS)))
+        return _queue
@@ -0,0 +1,61 @@
+import json
+
+# Incremental parsing of streamed JSON lists
+#
+# A streamed completion such as {"questions": [{...}, {...}]} arrives in small
+# text deltas. ObjectStream scans the deltas as they come in and returns each
+# element object of the list as soon as its closing brace has arrived, so the
+# first question can be shown long before the response is complete.
+
+class ObjectStream:
+    """Extract the objects inside a JSON list (top level or one level down) from text deltas"""
+
+    def __init__(self):
+        self._text = ""
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._start = None
+        self._position = 0
+
+    def _is_element(self):
+        """Whether the container stack is at list-element level"""
+        return self._stack in (["["], ["{", "["])
+
+    def feed(self, delta):
+        """Consume a text delta and return the list elements it completed"""
+        self._text += delta
+        objects = []
+
+        for i in range(self._position, len(self._text)):
+            char = self._text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "[{":
+                if char == "{" and self._is_element():
+                    self._start = i
+                self._stack.append(char)
+            elif char in "]}" and self._stack:
+                self._stack.pop()
+                if char == "}" and self._start is not None and self._is_element():
+                    try:
+                        objects.append(json.loads(self._text[self._start:i + 1]))
+                    except ValueError:
+                        pass
+                    self._start = None
+
+        self._position = len(self._text)
+        # Text before an element that is still open is never needed again
+        keep_from = self._start if self._start is not None else self._position
+        self._text = self._text[keep_from:]
+        self._position -= keep_from
+        if self._start is not None:
+            self._start = 0
+        return objects
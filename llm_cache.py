@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from profiler import profiled
+from sqlite_store import SQLiteStore
+
+# Shared LLM response cache
+#
+# Completions are stored in a small SQLite database so every Streamlit session
+# and every worker process on the machine sees the same entries. SQLite's own
+# file locking takes care of concurrent writers.
+#
+# Misses are coalesced: while one thread is generating a completion, every other
+# thread asking for the same key waits for that call instead of starting its own,
+# so a class creating spaces for the same topic at once costs a single request.
+
+DEFAULT_CACHE_PATH = "llm_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Share one in-flight call per key between all threads that ask for it"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def join(self, key):
+        """Return (flight, leader); only the leader runs the call and must finish() it"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        # Waiting threads get the leader's error, but never its KeyboardInterrupt or GeneratorExit
+        if error is not None and not isinstance(error, Exception):
+            error = RuntimeError("Generation was interrupted")
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+    @staticmethod
+    def wait(flight):
+        """Wait for another thread's call and return its result or raise its error"""
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def do(self, key, fn):
+        """Run fn() once for all concurrent callers with the same key
+
+        Returns (result, leader), where leader is False for callers that only
+        waited for someone else's call.
+        """
+        flight, leader = self.join(key)
+        if not leader:
+            return self.wait(flight), False
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result)
+        return result, True
+
+class LLMCache(SQLiteStore):
+    """Disk-backed completion cache with LRU and TTL eviction"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+        self.in_flight = SingleFlight()
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed_at ON entries (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('hits', 0), ('misses', 0)")
+
+    @staticmethod
+    def make_key(params):
+        """Build a stable key from the model, messages and sampling parameters
+
+        Whitespace in message text is collapsed so prompts that only differ in
+        spacing (e.g. a topic typed with a trailing space) share an entry.
+        """
+        if "messages" in params:
+            params = dict(params, messages=[
+                dict(m, content=" ".join(m["content"].split())) for m in params["messages"]
+            ])
+        payload = json.dumps(params, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, conn, name):
+        with self._counter_lock:
+            if name == "hits":
+                self.hits += 1
+            else:
+                self.misses += 1
+        conn.execute("UPDATE counters SET value = value + 1 WHERE name = ?", (name,))
+
+    @profiled("storage")
+    def get(self, key, count=True):
+        """Return the cached text for a key, or None on a miss
+
+        Pass count=False to look a key up again without it counting as another hit or miss.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                if count:
+                    self._count(conn, "misses")
+                return None
+
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            if count:
+                self._count(conn, "hits")
+            return row[0]
+
+    def set(self, key, value):
+        """Store text for a key and evict the least recently used entries over the limit"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl_seconds,))
+
+            overflow = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed_at LIMIT ?)",
+                    (overflow,)
+                )
+
+    def clear(self):
+        """Remove every cached entry"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def stats(self):
+        """Return hit/miss counters for this process and for all processes sharing the cache"""
+        with self._connect() as conn:
+            shared = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": shared.get("hits", 0),
+            "shared_misses": shared.get("misses", 0),
+            "coalesced": self.in_flight.coalesced,
+        }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """Return the process-wide cache, configured from the environment on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache(
+                path=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                ttl_seconds=int(os.getenv("LLM_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+            )
+        return _cache
@@ -0,0 +1,256 @@
+import os
+import time
+import random
+import threading
+import openai
+from chat_context import count_tokens
+from metrics import get_llm_metrics
+from profiler import profiled, profiled_iter
+from model_router import get_model_router
+
+# Shared OpenAI client
+#
+# Every generation goes through one client per process so HTTP connections are
+# reused, at most OPENAI_MAX_CONCURRENCY requests are in flight, and request
+# and token rates stay under the account quota (OPENAI_RPM / OPENAI_TPM).
+# Rate-limit and server errors are retried with jittered exponential backoff
+# instead of being shown to the user. Each call is recorded in metrics.py under
+# the name of the app function that made it. Calls that do not name a model are
+# routed through the function's model tiers in model_router.py.
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_RPM = 500
+DEFAULT_TPM = 40000
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_TIMEOUT = 60
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate tokens per second"""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount):
+        """Block until amount tokens are available, then take them"""
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+def _is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def _retry_after(error):
+    """Seconds the server asked us to wait, if it said"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+class LLMClient:
+    """Rate-limited, retrying wrapper around a single OpenAI client"""
+
+    def __init__(self, api_key=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM,
+                 max_retries=DEFAULT_MAX_RETRIES, timeout=DEFAULT_TIMEOUT):
+        # The SDK's own retries are disabled so they cannot bypass the limits below
+        self._client = openai.OpenAI(api_key=api_key, timeout=timeout, max_retries=0)
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._requests = TokenBucket(rpm, rpm / 60)
+        self._tokens = TokenBucket(tpm, tpm / 60)
+        self.max_retries = max_retries
+
+    def _estimate_tokens(self, params):
+        prompt = sum(count_tokens(m["content"], params.get("model", "gpt-4")) for m in params.get("messages", []))
+        return prompt + params.get("max_tokens", 0)
+
+    def _backoff_delay(self, attempt, error):
+        delay = _retry_after(error)
+        if delay is None:
+            # Full jitter keeps retries from many sessions from arriving together
+            delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+        return delay
+
+    def _acquire_quota(self, params):
+        self._requests.acquire(1)
+        self._tokens.acquire(self._estimate_tokens(params))
+
+    def _record(self, function, params, outcome, start, usage=None, ttft=None, retries=0, tier=0):
+        get_llm_metrics().record(
+            function,
+            params.get("model"),
+            outcome,
+            time.monotonic() - start,
+            ttft=ttft,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            retries=retries,
+            tier=tier
+        )
+
+    @staticmethod
+    def _over_budget(error, start, budget, delay=0.0):
+        """Whether a tier with a latency budget timed out or has no time left to wait delay and try again"""
+        if budget is None:
+            return False
+        return isinstance(error, openai.APITimeoutError) or time.monotonic() - start + delay >= budget
+
+    def _give_up(self, error, attempt, start, budget, delay):
+        """Return the outcome to record if a failed attempt should not be retried, else None"""
+        if self._over_budget(error, start, budget, delay):
+            return "over_budget"
+        if attempt == self.max_retries or not _is_retryable(error):
+            return "error"
+        return None
+
+    def _tiers(self, function, params):
+        """Yield (tier, params with the model set, latency budget) for each model to try"""
+        if "model" in params:
+            yield 0, params, None
+            return
+
+        router = get_model_router()
+        models = router.models(function)
+        for tier, model in enumerate(models):
+            yield tier, dict(params, model=model), None if tier == len(models) - 1 else router.budget(function)
+
+    @profiled("llm")
+    def create(self, function="unknown", served=None, **params):
+        """chat.completions.create with rate limiting, a concurrency cap and retries
+
+        Without a model in params, the call is routed through the function's
+        model tiers (see model_router.py). If served is a dict, the model and
+        tier that answered are stored in it.
+        """
+        tiers = list(self._tiers(function, params))
+        for tier, tier_params, budget in tiers:
+            try:
+                response = self._create(function, tier_params, tier, budget)
+            except Exception:
+                if tier == len(tiers) - 1:
+                    raise
+                continue
+            if served is not None:
+                served.update(model=tier_params["model"], tier=tier)
+            return response
+
+    def _create(self, function, params, tier, budget):
+        start = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            self._acquire_quota(params)
+            # Retries share the tier's budget, so each gets what is left of it
+            request_options = {"timeout": max(budget - (time.monotonic() - start), 0.001)} if budget is not None else {}
+            try:
+                with self._semaphore:
+                    response = self._client.chat.completions.create(**params, **request_options)
+            except Exception as e:
+                delay = self._backoff_delay(attempt, e)
+                outcome = self._give_up(e, attempt, start, budget, delay)
+                if outcome:
+                    self._record(function, params, outcome, start, retries=attempt, tier=tier)
+                    raise
+                time.sleep(delay)
+                continue
+
+            self._record(function, params, "ok", start, usage=response.usage, retries=attempt, tier=tier)
+            return response
+
+    def stream(self, function="unknown", served=None, **params):
+        """Yield chunks of a streamed completion, holding a concurrency slot until it ends
+
+        Failures (including a tier going over its latency budget) are only
+        retried or routed to the next tier before the first chunk has been
+        yielded. If served is a dict, the model and tier that answered are
+        stored in it once the first chunk arrives.
+        """
+        return profiled_iter("llm", self._routed_stream(function, params, served))
+
+    def _routed_stream(self, function, params, served):
+        tiers = list(self._tiers(function, params))
+        for tier, tier_params, budget in tiers:
+            chunks = self._stream(function, tier_params, tier, budget)
+            started = False
+            try:
+                for chunk in chunks:
+                    if not started and served is not None:
+                        served.update(model=tier_params["model"], tier=tier)
+                    started = True
+                    yield chunk
+                return
+            except Exception:
+                if started or tier == len(tiers) - 1:
+                    raise
+            finally:
+                chunks.close()
+
+    def _stream(self, function, params, tier, budget):
+        start = time.monotonic()
+        params.setdefault("stream_options", {"include_usage": True})
+        # The budget bounds each wait for a chunk, so mainly the time to first token
+        request_options = {"timeout": budget} if budget is not None else {}
+        for attempt in range(self.max_retries + 1):
+            self._acquire_quota(params)
+            started = False
+            ttft, usage = None, None
+            try:
+                with self._semaphore:
+                    for chunk in self._client.chat.completions.create(stream=True, **params, **request_options):
+                        started = True
+                        if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+                            ttft = time.monotonic() - start
+                        # With include_usage the last chunk carries the token counts and no choices
+                        usage = getattr(chunk, "usage", None) or usage
+                        yield chunk
+            except GeneratorExit:
+                # The reader stopped early (e.g. the page was rerun)
+                self._record(function, params, "cancelled", start, usage=usage, ttft=ttft, retries=attempt, tier=tier)
+                raise
+            except Exception as e:
+                delay = self._backoff_delay(attempt, e)
+                if started:
+                    # Too late to retry; the budget only counts here if a chunk took longer than it
+                    outcome = "over_budget" if self._over_budget(e, time.monotonic(), budget) else "error"
+                else:
+                    outcome = self._give_up(e, attempt, start, budget, delay)
+                if outcome:
+                    self._record(function, params, outcome, start, usage=usage, ttft=ttft, retries=attempt, tier=tier)
+                    raise
+                time.sleep(delay)
+                continue
+
+            self._record(function, params, "ok", start, usage=usage, ttft=ttft, retries=attempt, tier=tier)
+            return
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_llm_client():
+    """Return the process-wide client, configured from the environment on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                rpm=int(os.getenv("OPENAI_RPM", DEFAULT_RPM)),
+                tpm=int(os.getenv("OPENAI_TPM", DEFAULT_TPM)),
+                max_retries=int(os.getenv("OPENAI_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+                timeout=float(os.getenv("OPENAI_TIMEOUT", DEFAULT_TIMEOUT))
+            )
+        return _client
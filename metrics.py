@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import numpy as np
+from file_lock import file_lock
+
+# LLM call metrics
+#
+# Every OpenAI call (and every completion served from the cache or from another
+# caller's in-flight request) is recorded with its wall time, time to first
+# token when streaming, token usage, model, routing tier and outcome. Records are appended to
+# a JSONL log, aggregated into a Prometheus text file that node_exporter's
+# textfile collector can scrape, and summarized on the admin metrics page.
+#
+# Counters are kept per process, so each process writes its own text file
+# (the pid goes into the file name and a process label), at most once every
+# METRICS_PROM_INTERVAL seconds from a background thread. The JSONL log is
+# shared and rotated to "<path>.1" once it passes METRICS_LOG_MAX_BYTES.
+
+DEFAULT_LOG_PATH = "llm_metrics.jsonl"
+DEFAULT_PROM_PATH = "llm_metrics.prom"
+DEFAULT_PROM_INTERVAL = 10.0
+DEFAULT_LOG_MAX_BYTES = 20 * 1024 * 1024
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+def _labels(**labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+def process_prom_path(prom_path, pid=None):
+    """This process's text file for prom_path, e.g. llm_metrics.prom -> llm_metrics.1234.prom"""
+    root, ext = os.path.splitext(prom_path)
+    return f"{root}.{pid or os.getpid()}{ext or '.prom'}"
+
+def _tail_lines(path, limit, block_size=64 * 1024):
+    """Return up to the last limit lines of a file, reading it backwards from the end"""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return []
+    with f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        # One more newline than lines wanted, so the first line kept is whole
+        while position > 0 and data.count(b"\n") <= limit:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = data.decode("utf-8", errors="replace").splitlines()
+    if position > 0:
+        lines = lines[1:]
+    return lines[-limit:] if limit else []
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.total}'
+        yield f"{name}_sum{{{labels}}} {self.sum:.6f}"
+        yield f"{name}_count{{{labels}}} {self.total}"
+
+class LLMMetrics:
+    """Records LLM calls to a rotated JSONL log and this process's Prometheus text file"""
+
+    def __init__(self, log_path=DEFAULT_LOG_PATH, prom_path=DEFAULT_PROM_PATH,
+                 prom_interval=DEFAULT_PROM_INTERVAL, log_max_bytes=DEFAULT_LOG_MAX_BYTES):
+        self.log_path = log_path
+        self.prom_path = process_prom_path(prom_path)
+        self.prom_interval = prom_interval
+        self.log_max_bytes = log_max_bytes
+        self._calls = {}
+        self._tokens = {}
+        self._durations = {}
+        self._ttft = {}
+        self._dirty = False
+        self._thread = None
+        self._lock = threading.Lock()
+        atexit.register(self._remove_prometheus)
+
+    def record(self, function, model, outcome, duration, ttft=None, prompt_tokens=0, completion_tokens=0, retries=0, tier=0):
+        """Record one call; outcome is ok, error, over_budget, cancelled, cached or coalesced
+
+        tier is the position of the model in the function's route (0 for the primary model).
+        """
+        entry = {
+            "ts": time.time(),
+            "function": function,
+            "model": model,
+            "outcome": outcome,
+            "duration": round(duration, 4),
+            "ttft": round(ttft, 4) if ttft is not None else None,
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "retries": retries,
+            "tier": tier,
+        }
+
+        with self._lock:
+            key = (function, model, outcome)
+            self._calls[key] = self._calls.get(key, 0) + 1
+            for kind in ("prompt", "completion"):
+                token_key = (function, model, kind)
+                self._tokens[token_key] = self._tokens.get(token_key, 0) + entry[f"{kind}_tokens"]
+            self._durations.setdefault((function, model), _Histogram()).observe(duration)
+            if ttft is not None:
+                self._ttft.setdefault((function, model), _Histogram()).observe(ttft)
+
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                rotate = f.tell() > self.log_max_bytes
+            self._dirty = True
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-metrics", daemon=True)
+                self._thread.start()
+
+        if rotate:
+            self._rotate_log()
+
+    def _rotate_log(self):
+        """Move the log to "<path>.1" (replacing the previous one) unless another process just did"""
+        try:
+            with file_lock(self.log_path):
+                if os.path.getsize(self.log_path) > self.log_max_bytes:
+                    os.replace(self.log_path, f"{self.log_path}.1")
+        except OSError as e:
+            print(f"Error rotating {self.log_path}: {str(e)}", file=sys.stderr)
+
+    def _run(self):
+        while True:
+            time.sleep(self.prom_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing {self.prom_path}: {str(e)}", file=sys.stderr)
+
+    def flush(self):
+        """Write this process's counters to its Prometheus text file if they changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            text = self._prometheus_text()
+
+        # Write then rename so a scrape never sees a half-written file
+        tmp_path = f"{self.prom_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, self.prom_path)
+
+    def _remove_prometheus(self):
+        # Counters of a process that has exited would otherwise be exported forever
+        try:
+            os.remove(self.prom_path)
+        except OSError:
+            pass
+
+    def _prometheus_text(self):
+        process = os.getpid()
+        lines = [
+            "# HELP llm_calls_total LLM calls by function, model and outcome",
+            "# TYPE llm_calls_total counter",
+        ]
+        for (function, model, outcome), count in sorted(self._calls.items()):
+            lines.append(f"llm_calls_total{{{_labels(process=process, function=function, model=model, outcome=outcome)}}} {count}")
+
+        lines += ["# HELP llm_tokens_total Tokens used by function, model and kind", "# TYPE llm_tokens_total counter"]
+        for (function, model, kind), count in sorted(self._tokens.items()):
+            lines.append(f"llm_tokens_total{{{_labels(process=process, function=function, model=model, kind=kind)}}} {count}")
+
+        for name, help_text, histograms in (
+            ("llm_call_duration_seconds", "Wall time of LLM calls", self._durations),
+            ("llm_time_to_first_token_seconds", "Time to the first streamed token", self._ttft),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (function, model), histogram in sorted(histograms.items()):
+                lines.extend(histogram.lines(name, _labels(process=process, function=function, model=model)))
+        return "\n".join(lines) + "\n"
+
+    def recent(self, limit=10000):
+        """Return the newest logged records, oldest first, reading only the end of the log (and its rotated copy)"""
+        lines = _tail_lines(self.log_path, limit)
+        if len(lines) < limit:
+            lines = _tail_lines(f"{self.log_path}.1", limit - len(lines)) + lines
+        return [json.loads(line) for line in lines if line.strip()]
+
+def _model_mix(calls):
+    """Share of answered calls per model, most used first (e.g. gpt-4 80%, gpt-4o-mini 20%)"""
+    answered = [c["model"] for c in calls if c["outcome"] == "ok"]
+    shares = {model: answered.count(model) / len(answered) for model in set(answered)}
+    return ", ".join(f"{model} {share:.0%}" for model, share in sorted(shares.items(), key=lambda item: -item[1]))
+
+def summarize(records):
+    """Per-function call counts, error rate, routing mix, latency percentiles and average token usage"""
+    by_function = {}
+    for record in records:
+        by_function.setdefault(record["function"], []).append(record)
+
+    rows = []
+    for function, calls in sorted(by_function.items()):
+        durations = np.array([c["duration"] for c in calls])
+        ttfts = np.array([c["ttft"] for c in calls if c["ttft"] is not None])
+        p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+        rows.append({
+            "function": function,
+            "calls": len(calls),
+            "errors": sum(c["outcome"] == "error" for c in calls),
+            "over budget": sum(c["outcome"] == "over_budget" for c in calls),
+            "cached": sum(c["outcome"] in ("cached", "coalesced") for c in calls),
+            # Older records were written before routing and have no tier
+            "fallbacks": sum(c["outcome"] == "ok" and c.get("tier", 0) > 0 for c in calls),
+            "models": _model_mix(calls),
+            "p50 (s)": round(float(p50), 3),
+            "p95 (s)": round(float(p95), 3),
+            "p99 (s)": round(float(p99), 3),
+            "p50 TTFT (s)": round(float(np.percentile(ttfts, 50)), 3) if len(ttfts) else None,
+            "avg prompt tokens": round(float(np.mean([c["prompt_tokens"] for c in calls])), 1),
+            "avg completion tokens": round(float(np.mean([c["completion_tokens"] for c in calls])), 1),
+        })
+    return rows
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_llm_metrics():
+    """Return the process-wide recorder writing to METRICS_LOG_PATH and METRICS_PROM_PATH"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = LLMMetrics(
+                os.getenv("METRICS_LOG_PATH", DEFAULT_LOG_PATH),
+                os.getenv("METRICS_PROM_PATH", DEFAULT_PROM_PATH),
+                float(os.getenv("METRICS_PROM_INTERVAL", DEFAULT_PROM_INTERVAL)),
+                int(os.getenv("METRICS_LOG_MAX_BYTES", DEFAULT_LOG_MAX_BYTES))
+            )
+        return _metrics
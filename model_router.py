@@ -0,0 +1,62 @@
+import os
+import json
+import threading
+
+# Model routing per generation task
+#
+# Each app function has a list of model tiers, best first, and a latency
+# budget in seconds. The first tiers are retried with backoff as usual, but
+# only within the budget (the whole call including retries for plain calls,
+# the time to first token for streams); a call that runs over the budget or
+# uses up its retries moves on to the next, faster tier, and the last tier is
+# retried without a budget. Structured JSON tasks start on a fast model.
+# MODEL_ROUTES and MODEL_LATENCY_BUDGETS override the defaults with JSON
+# objects keyed by function name.
+
+DEFAULT_ROUTES = {
+    "generate_learning_content": ["gpt-4", "gpt-4o-mini"],
+    "chat_with_ai": ["gpt-4", "gpt-4o-mini"],
+    "summarize_chat": ["gpt-4o-mini", "gpt-3.5-turbo"],
+    "generate_quiz_questions": ["gpt-4o-mini", "gpt-3.5-turbo"],
+    "generate_learning_resources": ["gpt-4o-mini", "gpt-3.5-turbo"],
+}
+DEFAULT_BUDGETS = {
+    "generate_learning_content": 90,
+    "chat_with_ai": 30,
+    "summarize_chat": 30,
+    "generate_quiz_questions": 45,
+    "generate_learning_resources": 45,
+}
+# For functions without a route of their own
+FALLBACK_ROUTE = ["gpt-4", "gpt-4o-mini"]
+FALLBACK_BUDGET = 60
+
+class ModelRouter:
+    """Model tiers and latency budget for each app function"""
+
+    def __init__(self, routes=None, budgets=None):
+        self.routes = dict(DEFAULT_ROUTES, **(routes or {}))
+        self.budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+
+    def models(self, function):
+        """Models to try for a function, best first"""
+        return list(self.routes.get(function, FALLBACK_ROUTE))
+
+    def budget(self, function):
+        """Seconds a non-final tier may take before the call falls back"""
+        return float(self.budgets.get(function, FALLBACK_BUDGET))
+
+def _json_env(name):
+    value = os.getenv(name)
+    return json.loads(value) if value else {}
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_model_router():
+    """Return the process-wide router, with MODEL_ROUTES and MODEL_LATENCY_BUDGETS applied"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter(_json_env("MODEL_ROUTES"), _json_env("MODEL_LATENCY_BUDGETS"))
+        return _router
@@ -0,0 +1,57 @@
+import os
+import time
+import threading
+from collections import deque
+
+# Admission control for speculative generation
+#
+# Quizzes and resources generated ahead of a click, and question bank top-ups,
+# are a guess, so they only run while fewer than PREFETCH_MAX_CONCURRENT are in
+# flight and fewer than PREFETCH_PER_HOUR have started in the last hour (a cap
+# on what guessing can cost). Generation the user asked for is never held back
+# by these limits.
+
+DEFAULT_MAX_CONCURRENT = 2
+DEFAULT_PER_HOUR = 30
+
+class Prefetcher:
+    """Concurrency and hourly caps on speculative generations"""
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT, per_hour=DEFAULT_PER_HOUR):
+        self.max_concurrent = max_concurrent
+        self.per_hour = per_hour
+        self._running = 0
+        self._started = deque()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a slot for one speculative generation, or return False if a cap is reached"""
+        with self._lock:
+            now = time.monotonic()
+            while self._started and now - self._started[0] > 3600:
+                self._started.popleft()
+
+            if self._running >= self.max_concurrent or len(self._started) >= self.per_hour:
+                return False
+            self._running += 1
+            self._started.append(now)
+            return True
+
+    def release(self):
+        """Give back a slot once its generation has finished (or was never queued)"""
+        with self._lock:
+            self._running = max(self._running - 1, 0)
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+def get_prefetcher():
+    """Return the process-wide prefetcher limited by PREFETCH_MAX_CONCURRENT and PREFETCH_PER_HOUR"""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher(
+                int(os.getenv("PREFETCH_MAX_CONCURRENT", DEFAULT_MAX_CONCURRENT)),
+                int(os.getenv("PREFETCH_PER_HOUR", DEFAULT_PER_HOUR))
+            )
+        return _prefetcher
@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+import functools
+import threading
+
+# Opt-in per-rerun profiler
+#
+# With PROFILE_RERUNS set to "sidebar", "log" or both (comma separated), each
+# script run records how long it spent importing modules, in storage, in LLM
+# calls, and on everything else (building and rendering the page). Storage
+# and LLM entry points are wrapped with profiled(), which is a single
+# thread-local lookup when no profile is running, so background workers and
+# unprofiled runs pay next to nothing.
+
+DEFAULT_PROFILE_LOG_PATH = "rerun_profile.jsonl"
+PHASES = ("imports", "storage", "llm", "render")
+
+_local = threading.local()
+
+def profile_targets():
+    """Where rerun profiles go: a subset of {"sidebar", "log"}"""
+    return {target.strip() for target in os.getenv("PROFILE_RERUNS", "").lower().split(",") if target.strip()}
+
+class RerunProfile:
+    """Time spent per phase during one script run, counting nested phases only once"""
+
+    def __init__(self, started, imports):
+        self.started = started
+        self.seconds = {"imports": imports}
+        self.calls = {}
+        # Time spent in phases nested inside each open phase
+        self._nested = []
+
+    def enter(self):
+        self._nested.append(0.0)
+
+    def exit(self, phase, elapsed, calls=1):
+        nested = self._nested.pop()
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + elapsed - nested
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+        if self._nested:
+            self._nested[-1] += elapsed
+
+    def breakdown(self):
+        """Return {"total_ms", "phases": {phase: {"ms", "calls"}}}; render is whatever the other phases leave"""
+        total = time.perf_counter() - self.started
+        seconds = dict(self.seconds)
+        seconds["render"] = max(total - sum(seconds.values()), 0.0)
+        return {
+            "total_ms": round(total * 1000, 2),
+            "phases": {
+                phase: {"ms": round(seconds.get(phase, 0.0) * 1000, 2), "calls": self.calls.get(phase, 0)}
+                for phase in PHASES
+            },
+        }
+
+def start_rerun(started):
+    """Begin profiling this script run; started is perf_counter() from before the script's imports"""
+    _local.profile = RerunProfile(started, time.perf_counter() - started) if profile_targets() else None
+
+def current_profile():
+    return getattr(_local, "profile", None)
+
+def finish_rerun(label):
+    """Stop profiling this script run and append its breakdown to PROFILE_LOG_PATH if logging is on"""
+    profile = current_profile()
+    _local.profile = None
+    if profile is None or "log" not in profile_targets():
+        return
+
+    record = dict(profile.breakdown(), ts=time.time(), page=label)
+    try:
+        with open(os.getenv("PROFILE_LOG_PATH", DEFAULT_PROFILE_LOG_PATH), "a") as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"Error writing rerun profile: {str(e)}", file=sys.stderr)
+
+def profiled(phase):
+    """Decorator counting a function's time towards phase while a rerun is being profiled"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profile = current_profile()
+            if profile is None:
+                return fn(*args, **kwargs)
+
+            profile.enter()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.exit(phase, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def profiled_iter(phase, iterator):
+    """Count the time spent producing each item of iterator towards phase (e.g. a streamed completion)"""
+    iterator = iter(iterator)
+    first = True
+    try:
+        while True:
+            profile = current_profile()
+            if profile is not None:
+                profile.enter()
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                if profile is not None:
+                    profile.exit(phase, time.perf_counter() - start, calls=int(first))
+            first = False
+            yield item
+    finally:
+        # Pass an early close on so the wrapped stream can clean up
+        if hasattr(iterator, "close"):
+            iterator.close()
@@ -0,0 +1,454 @@
+import os
+import re
+import sys
+import time
+import zlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sqlite_store import SQLiteStore
+
+# Near-duplicate question cache for the tutor chat
+#
+# Every answered question is stored per topic. Questions are embedded locally
+# as hashed word and character n-gram TF-IDF vectors (no embedding service),
+# and new questions are compared against all stored ones for their topic with
+# one sparse matrix product, so students asking "what is a closure?" and
+# "explain closures" can be answered from the same stored reply. Topic
+# indexes are built on a background thread and the QA_CACHE_TOPICS most
+# recently used ones are kept in memory.
+
+DEFAULT_QA_DB_PATH = "qa_cache.sqlite"
+DEFAULT_DIM = 2 ** 18
+DEFAULT_MAX_TOPICS = 32
+# Content words a question needs besides its topic's name to be stored or looked up
+MIN_CONTENT_WORDS = 1
+# Rebuild the TF-IDF weights once a topic has grown by this fraction
+REWEIGHT_GROWTH = 0.1
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# Question phrasing that says nothing about what is being asked
+_STOPWORDS = frozenset("""
+    a an the is are was were be been being am what whats how why when where which who whom do does did
+    can could would should will shall may might must i me my we our you your it its this that these those
+    of in on at for to from by with about into and or but if so than then there please tell explain
+    describe define definition mean means meaning give show example examples some any work works
+""".split())
+
+def normalize_topic(topic):
+    return " ".join(topic.lower().split())
+
+def _stem(word):
+    """Strip common English suffixes so "closures" and "closure" share features"""
+    for suffix, replacement in (("ies", "y"), ("ing", ""), ("ed", ""), ("s", "")):
+        if word.endswith(suffix) and not word.endswith("ss") and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + replacement
+    return word
+
+def _content_words(text):
+    return [_stem(w) for w in _WORD_RE.findall(text.lower()) if w not in _STOPWORDS]
+
+def _subject_words(text, topic):
+    """Content words of a question other than its topic's own words"""
+    topic_words = set(_content_words(topic))
+    return {word for word in _content_words(text) if word not in topic_words}
+
+def shares_subject(question, stored_question, topic):
+    """Whether two questions on a topic have a content word in common besides the topic's name"""
+    return bool(_subject_words(question, topic) & _subject_words(stored_question, topic))
+
+def _features(text):
+    """Yield stemmed content words, their bigrams and their character trigrams"""
+    words = _content_words(text)
+    for i, word in enumerate(words):
+        yield f"w:{word}"
+        if i:
+            yield f"b:{words[i - 1]} {word}"
+        padded = f"<{word}>"
+        for j in range(len(padded) - 2):
+            yield f"c:{padded[j:j + 3]}"
+
+def hash_features(text, dim=DEFAULT_DIM):
+    """Signed feature hashing of a question into (buckets, sublinear term frequencies)"""
+    counts = {}
+    for feature in _features(text):
+        h = zlib.crc32(feature.encode("utf-8"))
+        bucket = h % dim
+        counts[bucket] = counts.get(bucket, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+
+    buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    keep = values != 0
+    values = values[keep]
+    return buckets[keep], np.sign(values) * np.log1p(np.abs(values))
+
+def _gather(starts, lengths):
+    """Indexes of the concatenated slices [start, start + length)"""
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+def _lookup(keys, buckets):
+    """Positions of buckets in the sorted keys array and whether each was found"""
+    if not len(keys):
+        return np.zeros(len(buckets), dtype=np.int64), np.zeros(len(buckets), dtype=bool)
+    positions = np.minimum(np.searchsorted(keys, buckets), len(keys) - 1)
+    return positions, keys[positions] == buckets
+
+class _IDF:
+    """Smoothed IDF weights of the buckets a topic's questions use
+
+    Every question is about its topic, so the topic's own features count as
+    appearing in all of them and get the lowest weight instead of none.
+    """
+
+    def __init__(self, row_buckets, count, topic_buckets):
+        keys, df = np.unique(np.concatenate(list(row_buckets) + [topic_buckets]), return_counts=True)
+        df[np.isin(keys, topic_buckets)] = count + 1
+        self.keys = keys
+        self.values = (np.log((1 + count) / df) + 1).astype(np.float32)
+        # Buckets no stored question uses
+        self.unseen = np.float32(np.log(1 + count) + 1)
+
+    def __call__(self, buckets):
+        positions, found = _lookup(self.keys, buckets)
+        return np.where(found, self.values[positions], self.unseen)
+
+class _Postings:
+    """Weighted, row-normalized question vectors over the buckets in use
+
+    Kept both row-major (CSR), to score a few candidate rows, and column-major
+    (CSC), to find candidates and to score every row at once.
+    """
+
+    def __init__(self, row_buckets, row_values, idf):
+        lengths = np.array([len(b) for b in row_buckets], dtype=np.int64)
+        rows = np.repeat(np.arange(len(row_buckets)), lengths)
+        buckets = np.concatenate(row_buckets)
+        weighted = np.concatenate(row_values) * idf(buckets)
+        norms = np.sqrt(np.bincount(rows, weighted * weighted))
+        weighted = weighted / np.maximum(norms[rows], 1e-12)
+
+        self.row_ptr = np.concatenate(([0], np.cumsum(lengths)))
+        self.row_buckets = buckets
+        self.row_values = weighted
+
+        order = np.argsort(buckets, kind="stable")
+        self.rows = rows[order]
+        self.values = weighted[order]
+        self.keys, starts = np.unique(buckets[order], return_index=True)
+        self.indptr = np.append(starts, len(order))
+
+    def scores(self, query_buckets, query_values, query_index, size):
+        """Accumulate dot products of several queries into one flat (queries x size) array"""
+        positions, found = _lookup(self.keys, query_buckets)
+        starts = self.indptr[positions[found]]
+        lengths = self.indptr[positions[found] + 1] - starts
+        if not lengths.sum():
+            return None
+
+        positions = _gather(starts, lengths)
+        weights = self.values[positions] * np.repeat(query_values[found], lengths)
+        targets = self.rows[positions] + np.repeat(query_index[found], lengths) * size
+        return np.bincount(targets, weights, minlength=size * (query_index.max() + 1))
+
+    def best(self, query_buckets, query_values, min_score):
+        """Return (row, score) of the closest row to one query if it scores at least min_score, else None
+
+        A row sharing none of the query's rarest features can score at most
+        the norm of the query's remaining features, so once that is below
+        min_score only the rows in the rarest features' postings are scored.
+        """
+        positions, found = _lookup(self.keys, query_buckets)
+        lengths = np.where(found, self.indptr[positions + 1] - self.indptr[positions], 0)
+        order = np.argsort(lengths, kind="stable")
+        # remaining[k]: norm of the query outside its k rarest features
+        remaining = np.sqrt(np.append(np.cumsum((query_values[order] ** 2)[::-1])[::-1], 0.0))
+        rarest = order[:int(np.argmax(remaining < min_score))]
+        rarest = rarest[found[rarest]]
+        if not len(rarest):
+            return None
+        size = len(self.row_ptr) - 1
+        if lengths[rarest].sum() * len(self.row_buckets) / size > lengths.sum():
+            # Scoring the candidates row by row would cost more than scoring every row
+            scores = self.scores(query_buckets, query_values, np.zeros(len(query_buckets), dtype=np.int64), size)
+            best = int(scores.argmax())
+            return (best, float(scores[best])) if scores[best] >= min_score else None
+
+        starts = self.indptr[positions[rarest]]
+        candidates = np.unique(self.rows[_gather(starts, lengths[rarest])])
+
+        # Exact dot products of the candidate rows with the query
+        starts = self.row_ptr[candidates]
+        lengths = self.row_ptr[candidates + 1] - starts
+        entries = _gather(starts, lengths)
+        query_order = np.argsort(query_buckets)
+        matched, hit = _lookup(query_buckets[query_order], self.row_buckets[entries])
+        products = np.where(hit, query_values[query_order][matched] * self.row_values[entries], 0.0)
+        scores = np.bincount(np.repeat(np.arange(len(candidates)), lengths), products, minlength=len(candidates))
+
+        best = int(scores.argmax())
+        if scores[best] < min_score:
+            return None
+        return int(candidates[best]), float(scores[best])
+
+class _TopicIndex:
+    """Sparse TF-IDF vectors for one topic, searched with a batched sparse matrix product
+
+    Rows are kept in a main CSC matrix whose IDF weights are recomputed when
+    the topic has grown by REWEIGHT_GROWTH, plus a small delta matrix for rows
+    added since, so adding an answer never rebuilds the whole topic. Only the
+    buckets the topic's questions use are stored, so memory grows with the
+    number of questions rather than the hashing dimension.
+    """
+
+    def __init__(self, dim, topic):
+        self.dim = dim
+        self.topic_buckets = hash_features(topic, dim)[0]
+        self.ids = []
+        self.questions = []
+        self.row_buckets = []
+        self.row_values = []
+        self.idf = _IDF([], 0, self.topic_buckets)
+        self.main = None
+        self.main_size = 0
+        self.delta = None
+        self.last_id = 0
+        self._lock = threading.Lock()
+
+    def add(self, rows):
+        """Append (id, question) rows loaded from the database to the delta matrix"""
+        with self._lock:
+            rows = [(row_id, question) for row_id, question in rows if row_id > self.last_id]
+            if not rows:
+                return
+
+            for row_id, question in rows:
+                buckets, values = hash_features(question, self.dim)
+                self.ids.append(row_id)
+                self.questions.append(question)
+                self.row_buckets.append(buckets)
+                self.row_values.append(values)
+            self.last_id = rows[-1][0]
+            self.delta = _Postings(self.row_buckets[self.main_size:], self.row_values[self.main_size:], self.idf)
+
+    def needs_reweight(self):
+        return len(self.ids) > self.main_size * (1 + REWEIGHT_GROWTH)
+
+    def reweight(self):
+        """Recompute the IDF weights and fold the delta rows into the main matrix"""
+        with self._lock:
+            count = len(self.ids)
+            row_buckets = self.row_buckets[:count]
+            row_values = self.row_values[:count]
+
+        # Searches carry on against the old matrices while the new ones are built
+        idf = _IDF(row_buckets, count, self.topic_buckets)
+        main = _Postings(row_buckets, row_values, idf)
+
+        with self._lock:
+            self.idf = idf
+            self.main = main
+            self.main_size = count
+            self.delta = _Postings(self.row_buckets[count:], self.row_values[count:], idf) if len(self.ids) > count else None
+
+    def _best(self, question, min_score, idf, parts):
+        buckets, values = hash_features(question, self.dim)
+        weighted = values * idf(buckets)
+        weighted = weighted / max(float(np.linalg.norm(weighted)), 1e-12)
+
+        best = (None, 0.0)
+        for postings, offset in parts:
+            match = postings.best(buckets, weighted, min_score) if postings is not None else None
+            if match is not None and (best[0] is None or match[1] > best[1]):
+                best = (offset + match[0], match[1])
+        return best
+
+    def search(self, questions, min_score=0.0):
+        """Return (best row index, cosine score) for each question
+
+        With min_score set, only matches scoring at least that much are
+        looked for (others come back as (None, 0.0)), which lets a lookup
+        score a few candidate rows instead of the whole topic.
+        """
+        with self._lock:
+            idf, main, main_size, delta, count = self.idf, self.main, self.main_size, self.delta, len(self.ids)
+        if not count:
+            return [(None, 0.0)] * len(questions)
+        if min_score > 0:
+            return [self._best(question, min_score, idf, ((main, 0), (delta, main_size))) for question in questions]
+
+        query_buckets, query_values, query_index = [], [], []
+        for i, question in enumerate(questions):
+            buckets, values = hash_features(question, self.dim)
+            weighted = values * idf(buckets)
+            query_buckets.append(buckets)
+            query_values.append(weighted / max(float(np.linalg.norm(weighted)), 1e-12))
+            query_index.append(np.full(len(buckets), i))
+        query_buckets = np.concatenate(query_buckets)
+        query_values = np.concatenate(query_values)
+        query_index = np.concatenate(query_index)
+
+        scores = np.zeros((len(questions), count), dtype=np.float64)
+        for postings, offset, size in ((main, 0, main_size), (delta, main_size, count - main_size)):
+            if postings is None or not size or not len(query_buckets):
+                continue
+            flat = postings.scores(query_buckets, query_values, query_index, size)
+            if flat is not None:
+                scores[:, offset:offset + size] = flat[:len(questions) * size].reshape(len(questions), size)
+
+        best = scores.argmax(axis=1)
+        return [(int(i), float(scores[row, i])) for row, i in enumerate(best)]
+
+class QACache(SQLiteStore):
+    """Stored tutor answers per topic, searchable by question similarity"""
+
+    def __init__(self, path=DEFAULT_QA_DB_PATH, dim=DEFAULT_DIM, max_topics=DEFAULT_MAX_TOPICS):
+        super().__init__(path)
+        self.dim = dim
+        self.max_topics = max_topics
+        self._topics = OrderedDict()
+        self._building = set()
+        self._builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qa-index")
+        self._lock = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_topic ON answers (topic, id)")
+
+    @staticmethod
+    def is_cacheable(question, topic):
+        """Questions with no content word besides the topic's name ("and why?", "explain it in python") depend on the conversation, so they are never shared"""
+        return len(_subject_words(question, topic)) >= MIN_CONTENT_WORDS
+
+    def _refresh(self, topic, index):
+        """Add the rows stored since the index was last read (by any process)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, question FROM answers WHERE topic = ? AND id > ? ORDER BY id",
+                (topic, index.last_id)
+            ).fetchall()
+        index.add(rows)
+
+    def _load(self, topic):
+        """Bring a topic's index up to date, reweighting it if it has grown, and keep it in memory"""
+        with self._lock:
+            index = self._topics.get(topic)
+        if index is None:
+            index = _TopicIndex(self.dim, topic)
+
+        self._refresh(topic, index)
+        if index.needs_reweight():
+            index.reweight()
+
+        with self._lock:
+            self._topics[topic] = index
+            self._topics.move_to_end(topic)
+            while len(self._topics) > self.max_topics:
+                self._topics.popitem(last=False)
+        return index
+
+    def _load_in_background(self, topic):
+        try:
+            self._load(topic)
+        except Exception as e:
+            print(f"Error building the answer index for {topic}: {str(e)}", file=sys.stderr)
+        finally:
+            with self._lock:
+                self._building.discard(topic)
+
+    def _schedule(self, topic):
+        with self._lock:
+            if topic in self._building:
+                return
+            self._building.add(topic)
+        self._builder.submit(self._load_in_background, topic)
+
+    def warm(self, topic):
+        """Start building the topic's index in the background if it is not in memory"""
+        topic = normalize_topic(topic)
+        with self._lock:
+            loaded = topic in self._topics
+        if not loaded:
+            self._schedule(topic)
+
+    def _index(self, topic, wait=False):
+        """Return the topic's index with the rows stored since it was last read
+
+        An index that is not in memory is built in the background and None is
+        returned meanwhile, unless wait is set. Reweighting a grown index also
+        happens in the background.
+        """
+        with self._lock:
+            index = self._topics.get(topic)
+            if index is not None:
+                self._topics.move_to_end(topic)
+
+        if index is None:
+            if wait:
+                return self._load(topic)
+            self._schedule(topic)
+            return None
+
+        self._refresh(topic, index)
+        if index.needs_reweight():
+            self._schedule(topic)
+        return index
+
+    def add(self, topic, question, answer):
+        if not self.is_cacheable(question, topic):
+            return
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO answers (topic, question, answer, created_at) VALUES (?, ?, ?, ?)",
+                (normalize_topic(topic), question, answer, time.time())
+            )
+
+    def search(self, topic, questions, wait=True, min_score=0.0):
+        """Return (score, stored question, answer) of the closest match for each question
+
+        Without wait, a topic whose index is still being built has no matches;
+        with min_score, neither do questions whose closest match scores less.
+        """
+        index = self._index(normalize_topic(topic), wait)
+        if index is None:
+            return [None] * len(questions)
+        matches = index.search(questions, min_score)
+
+        results = []
+        with self._connect() as conn:
+            for row, score in matches:
+                if row is None:
+                    results.append(None)
+                    continue
+                answer = conn.execute("SELECT answer FROM answers WHERE id = ?", (index.ids[row],)).fetchone()[0]
+                results.append((score, index.questions[row], answer))
+        return results
+
+    def lookup(self, topic, question, min_score=0.0):
+        """Return (score, stored question, answer) for the closest stored question scoring at least min_score, or None"""
+        if not self.is_cacheable(question, topic):
+            return None
+        return self.search(topic, [question], wait=False, min_score=min_score)[0]
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_qa_cache():
+    """Return the process-wide answer cache at QA_CACHE_PATH"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QACache(
+                os.getenv("QA_CACHE_PATH", DEFAULT_QA_DB_PATH),
+                int(os.getenv("QA_CACHE_DIM", DEFAULT_DIM)),
+                int(os.getenv("QA_CACHE_TOPICS", DEFAULT_MAX_TOPICS))
+            )
+        return _cache
@@ -0,0 +1,94 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from qa_cache import normalize_topic
+from sqlite_store import SQLiteStore
+
+# Persistent quiz question bank
+#
+# Every generated quiz question is kept per normalized topic and difficulty,
+# with duplicates (the same question text up to case, spacing and punctuation)
+# stored once. Quizzes for a topic can then be drawn at random from the bank
+# without calling the LLM, which only has to top the bank up when it runs low.
+
+DEFAULT_BANK_PATH = "question_bank.sqlite"
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+def question_id(question):
+    """Stable id of a question, shared by every wording that differs only in case, spacing or punctuation"""
+    normalized = " ".join(_WORD_RE.findall(question["question"].lower()))
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+class QuestionBank(SQLiteStore):
+    """Deduplicated quiz questions per topic and difficulty"""
+
+    def __init__(self, path=DEFAULT_BANK_PATH):
+        super().__init__(path)
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS questions (
+                    topic TEXT NOT NULL,
+                    difficulty TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (topic, difficulty, id)
+                )
+            """)
+
+    def add(self, topic, difficulty, questions):
+        """Store questions not already in the bank; returns the questions with their ids set"""
+        now = time.time()
+        stored = [dict(question, id=question_id(question)) for question in questions]
+
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO questions (topic, difficulty, id, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(normalize_topic(topic), difficulty.lower(), q["id"], json.dumps(q), now) for q in stored]
+            )
+        return stored
+
+    def count(self, topic, difficulty):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM questions WHERE topic = ? AND difficulty = ?",
+                (normalize_topic(topic), difficulty.lower())
+            ).fetchone()[0]
+
+    def questions(self, topic, difficulty):
+        """Return every stored question for a topic and difficulty, oldest first"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT data FROM questions WHERE topic = ? AND difficulty = ? ORDER BY created_at, id",
+                (normalize_topic(topic), difficulty.lower())
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def draw(self, topic, difficulty, num_questions, exclude=()):
+        """Return num_questions random questions, preferring ones not in exclude, or None if the bank is too small"""
+        questions = self.questions(topic, difficulty)
+        if len(questions) < num_questions:
+            return None
+
+        fresh = [q for q in questions if q["id"] not in exclude]
+        seen = [q for q in questions if q["id"] in exclude]
+        random.shuffle(fresh)
+        random.shuffle(seen)
+        return (fresh + seen)[:num_questions]
+
+_bank = None
+_bank_lock = threading.Lock()
+
+def get_question_bank():
+    """Return the process-wide question bank at QUESTION_BANK_PATH"""
+    global _bank
+    with _bank_lock:
+        if _bank is None:
+            _bank = QuestionBank(os.getenv("QUESTION_BANK_PATH", DEFAULT_BANK_PATH))
+        return _bank
@@ -1,5 +1,13 @@
+import time
 import streamlit as st
-from utils import get_space_by_id, update_space, generate_quiz_questions
+from utils import (
+    get_space_by_id, update_space_fields, draw_quiz, prefetch_space_fields,
+    ensure_space_generation, display_generation_progress, watch_generation, load_partial_field
+)
+from blobstore import load_space_field
+from question_bank import question_id
+from quiz_history import get_quiz_history
+from qa_cache import normalize_topic
 
 def quiz_view(space_id):
     """Display a quiz view for the given space"""
@@ -34,35 +42,89 @@ def quiz_view(space_id):
         st.session_state.submitted_answers = {}
     if 'quiz_completed' not in st.session_state:
         st.session_state.quiz_completed = False
+    if 'question_started' not in st.session_state:
+        st.session_state.question_started = {}
+    if 'answer_seconds' not in st.session_state:
+        st.session_state.answer_seconds = {}
+    if 'attempt_recorded' not in st.session_state:
+        st.session_state.attempt_recorded = False
     
-    # Check if quiz questions exist or need to be generated
-    if not space.get('has_quiz', False) or not space.get('quiz_questions'):
-        with st.spinner("Generating quiz questions..."):
-            st.info("Creating a quiz to test your knowledge on this topic.")
-            
-            # Generate quiz questions
-            difficulty = st.session_state.content_customization['difficulty_level'].lower()
-            questions = generate_quiz_questions(space['topic'], difficulty)
-            
-            # Update space with quiz questions
-            space['has_quiz'] = True
-            space['quiz_questions'] = questions
-            update_space(space)
+    generating = 'quiz_questions' in space.get('pending_fields', [])
+    if generating:
+        # Questions stream in one by one; show those received so far
+        questions = load_partial_field(space, 'quiz_questions', [])
+    else:
+        questions = load_space_field(space, 'quiz_questions', [])
     
-    questions = space.get('quiz_questions', [])
+    # Save a finished attempt once, before it feeds into the next difficulty
+    if st.session_state.quiz_completed and not st.session_state.attempt_recorded:
+        record_attempt(space, questions)
+        st.session_state.attempt_recorded = True
     
+    difficulty, customization = next_quiz_settings(space)
+    
+    # Popular topics can take a quiz straight from the question bank, with no LLM call
+    if not questions and not generating:
+        questions = draw_quiz(space['topic'], difficulty.lower()) or []
+        if questions:
+            update_space_fields(space_id, quiz_questions=questions, has_quiz=True, quiz_difficulty=difficulty)
+    
+    # Check if quiz questions exist or need to be generated
     if not questions:
-        st.error("Failed to generate quiz questions. Please try again later.")
+        if 'quiz_questions' in space.get('failed_fields', []):
+            st.error("Failed to generate quiz questions. Please try again later.")
+            if st.button("Try Again"):
+                ensure_space_generation(space, ['quiz_questions'], customization)
+                st.rerun()
+            return
+        
+        # Generate quiz questions in the background and pick them up on a later rerun
+        st.info("Creating a quiz to test your knowledge on this topic.")
+        if not generating:
+            update_space_fields(space_id, quiz_difficulty=difficulty)
+        ensure_space_generation(space, ['quiz_questions'], customization)
+        display_generation_progress(space)
+        watch_generation([space_id])
         return
     
+    if generating:
+        # Questions arrive one by one as they stream in; keep picking up new ones
+        ensure_space_generation(space, ['quiz_questions'], customization)
+        watch_generation([space_id])
+    
     # Display quiz
     if st.session_state.quiz_completed:
-        display_quiz_results(questions)
+        display_quiz_results(questions, space, difficulty)
     else:
-        display_quiz_questions(questions)
+        display_quiz_questions(questions, generating)
+
+def next_quiz_settings(space):
+    """Return the difficulty of the learner's next quiz on the space's topic and the customization to generate it with"""
+    # The difficulty follows the learner's recent scores on this topic
+    difficulty = get_quiz_history().next_difficulty(
+        st.session_state.username,
+        space['topic'],
+        st.session_state.content_customization['difficulty_level']
+    )
+    return difficulty, dict(st.session_state.content_customization, difficulty_level=difficulty)
+
+def prefetch_quiz(space):
+    """Prepare the space's next quiz before the learner asks for it"""
+    if space.get('has_quiz') or 'quiz_questions' in space.get('pending_fields', []) + space.get('failed_fields', []):
+        return
+    
+    difficulty, customization = next_quiz_settings(space)
+    questions = draw_quiz(space['topic'], difficulty.lower())
+    if questions:
+        update_space_fields(space['id'], quiz_questions=questions, has_quiz=True, quiz_difficulty=difficulty)
+    elif prefetch_space_fields(space, ['quiz_questions'], customization):
+        update_space_fields(space['id'], quiz_difficulty=difficulty)
 
-def display_quiz_questions(questions):
-    """Display the current quiz question"""
+def display_quiz_questions(questions, generating=False):
+    """Display the current quiz question
+    
+    While generating, questions holds those received so far and more are on the way.
+    """
     if not questions:
         return
     
@@ -70,12 +132,23 @@ def display_quiz_questions(questions):
     total_questions = len(questions)
     current_q = st.session_state.current_question
     
+    if current_q >= total_questions:
+        if generating:
+            st.info("The next question is still being generated...")
+            return
+        
+        # Generation finished without any further questions
+        st.session_state.quiz_completed = True
+        calculate_score(questions)
+        st.rerun()
+    
     st.progress(current_q / total_questions)
-    st.write(f"Question {current_q + 1} of {total_questions}")
+    st.write(f"Question {current_q + 1} of {total_questions}" + (" (more on the way)" if generating else ""))
     
     # Display current question
     if current_q < total_questions:
         question = questions[current_q]
+        st.session_state.question_started.setdefault(current_q, time.time())
         
         st.subheader(question['question'])
         
@@ -95,9 +168,10 @@ def display_quiz_questions(questions):
                 # Record answer
                 selected_option = option[0]  # Get the letter (A, B, C, D)
                 st.session_state.submitted_answers[current_q] = selected_option
+                st.session_state.answer_seconds[current_q] = time.time() - st.session_state.question_started[current_q]
                 
                 # Move to next question or complete quiz
-                if current_q < total_questions - 1:
+                if current_q < total_questions - 1 or generating:
                     st.session_state.current_question += 1
                     st.rerun()
                 else:
@@ -121,7 +195,22 @@ def calculate_score(questions):
     st.session_state.score = score
     st.session_state.total_questions = total
 
-def display_quiz_results(questions):
+def record_attempt(space, questions):
+    """Append the finished attempt to the learner's quiz history"""
+    answers = []
+    for i, question in enumerate(questions):
+        answer = st.session_state.submitted_answers.get(i)
+        answers.append({
+            "question_id": question.get('id') or question_id(question),
+            "answer": answer,
+            "correct": answer == question['answer'],
+            "seconds": st.session_state.answer_seconds.get(i, 0.0)
+        })
+    
+    difficulty = space.get('quiz_difficulty') or st.session_state.content_customization['difficulty_level']
+    get_quiz_history().record_attempt(st.session_state.username, space['id'], space['topic'], difficulty, answers)
+
+def display_quiz_results(questions, space, difficulty):
     """Display the quiz results"""
     score = st.session_state.score
     total = st.session_state.total_questions
@@ -141,11 +230,36 @@ def display_quiz_results(questions):
     else:
         st.warning(f"You scored {score}/{total} ({score_percentage:.1f}%). Keep studying!")
     
+    st.caption(f"Your next quiz on this topic will be at {difficulty} level.")
+    
+    # Scores of every attempt on this topic, oldest first
+    trend = get_quiz_history().topic_trend(st.session_state.username, space['topic'])
+    if len(trend) > 1:
+        st.subheader("Your Progress")
+        st.line_chart({"Score (%)": [round(attempt['score'] * 100) for attempt in trend]})
+    
+    # How this topic compares with everything else the learner has been quizzed on
+    accuracy = get_quiz_history().topic_accuracy(st.session_state.username)
+    topic_answers = accuracy.get(normalize_topic(space['topic']))
+    if topic_answers and len(accuracy) > 1:
+        answered = sum(a for a, _, _ in accuracy.values())
+        correct = sum(c for _, c, _ in accuracy.values())
+        st.caption(
+            f"You have answered {topic_answers[2]:.0%} of {topic_answers[0]} questions on this topic correctly, "
+            f"and {correct / answered:.0%} across all your topics."
+        )
+    
     # Review answers
     st.subheader("Review Your Answers")
     
+    stats = get_quiz_history().question_difficulty([q.get('id') or question_id(q) for q in questions])
+    
     for i, question in enumerate(questions):
         with st.expander(f"Question {i+1}: {question['question']}"):
+            answered, correct_share = stats.get(question.get('id') or question_id(question), (0, 0.0))
+            if answered > 1:
+                st.caption(f"{correct_share:.0%} of {answered} answers to this question were correct")
+            
             user_answer = st.session_state.submitted_answers.get(i, "Not answered")
             correct_answer = question['answer']
             
@@ -168,9 +282,20 @@ def display_quiz_results(questions):
     
     # Option to retry
     if st.button("Retry Quiz"):
+        # Draw a fresh set of questions from the bank, avoiding the ones just answered where possible
+        fresh = draw_quiz(space['topic'], difficulty.lower(), len(questions), exclude={q.get('id') for q in questions})
+        if fresh:
+            update_space_fields(space['id'], quiz_questions=fresh, has_quiz=True, quiz_difficulty=difficulty)
+        elif difficulty != space.get('quiz_difficulty', difficulty):
+            # Nothing banked at the new level yet, so generate a quiz there
+            update_space_fields(space['id'], quiz_questions=[], has_quiz=False, quiz_difficulty=difficulty)
+        
         # Reset quiz state
         st.session_state.current_question = 0
         st.session_state.score = 0
         st.session_state.submitted_answers = {}
+        st.session_state.question_started = {}
+        st.session_state.answer_seconds = {}
+        st.session_state.attempt_recorded = False
         st.session_state.quiz_completed = False
         st.rerun()
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from qa_cache import normalize_topic
+from file_lock import file_lock
+
+# Quiz attempt history
+#
+# Every answered question is appended as one row to a set of column files
+# (one raw NumPy array per field), with usernames, topics, spaces and question
+# ids interned as small integers. Reads map the columns straight into arrays,
+# picking up only the rows appended since the last read, so per-topic accuracy,
+# per-question difficulty and score trends are a few vectorized passes even
+# over millions of answers.
+#
+# Several processes can share the directory: ids are positions in the shared
+# strings.jsonl, which every process reads as it grows, and interning,
+# attempt numbering and column appends all happen under one cross-process
+# lock, so an id means the same string everywhere.
+
+DEFAULT_HISTORY_DIR = "quiz_history"
+DIFFICULTY_LEVELS = ["Beginner", "Intermediate", "Advanced", "Expert"]
+ANSWER_LETTERS = "ABCD"
+COLUMNS = {
+    "attempt": np.int64,
+    "user": np.int32,
+    "topic": np.int32,
+    "space": np.int32,
+    "question": np.int32,
+    "difficulty": np.int8,
+    "answer": np.int8,
+    "correct": np.int8,
+    "seconds": np.float32,
+    "ts": np.float64,
+}
+STRING_KINDS = ("user", "topic", "space", "question")
+# Attempts looked at when choosing the next difficulty, and the scores that move it
+RECENT_ATTEMPTS = 2
+STEP_UP_ACCURACY = 0.8
+STEP_DOWN_ACCURACY = 0.5
+
+def difficulty_index(difficulty):
+    """Position of a difficulty name in DIFFICULTY_LEVELS (case-insensitive)"""
+    names = [level.lower() for level in DIFFICULTY_LEVELS]
+    return names.index(difficulty.lower()) if difficulty.lower() in names else 1
+
+class QuizHistory:
+    """Append-only columnar store of quiz answers with vectorized aggregates"""
+
+    def __init__(self, root=DEFAULT_HISTORY_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._strings = {kind: {} for kind in STRING_KINDS}
+        self._names = {kind: [] for kind in STRING_KINDS}
+        # Arrays grow by doubling so appends are not copied on every read
+        self._buffers = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self._rows = 0
+        # Running answer counts per question id, updated as rows are loaded
+        self._question_answered = np.zeros(0)
+        self._question_correct = np.zeros(0)
+        # Bytes of strings.jsonl read so far
+        self._strings_read = 0
+        self._strings_path = os.path.join(root, "strings.jsonl")
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self._read_strings()
+
+    def _column_path(self, name):
+        return os.path.join(self.root, f"{name}.bin")
+
+    def _read_strings(self):
+        """Pick up strings interned since the last read, by this or any other process (caller holds the lock)"""
+        try:
+            with open(self._strings_path, "rb") as f:
+                f.seek(self._strings_read)
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        # A line still being written is left for the next read
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            kind, value = json.loads(line)
+            self._strings[kind][value] = len(self._names[kind])
+            self._names[kind].append(value)
+        self._strings_read += len(complete)
+
+    def _intern(self, kind, value):
+        """Return the integer id of a string, assigning one on first use (caller holds both locks)"""
+        if value not in self._strings[kind]:
+            with open(self._strings_path, "a") as f:
+                f.write(json.dumps([kind, value]) + "\n")
+            self._read_strings()
+        return self._strings[kind][value]
+
+    def _drop_partial_rows(self):
+        """Cut columns back to their whole rows, so an interrupted write cannot misalign the next (caller holds both locks)"""
+        rows = self._stored_rows()
+        for name, dtype in COLUMNS.items():
+            path = self._column_path(name)
+            if os.path.exists(path) and os.path.getsize(path) > rows * np.dtype(dtype).itemsize:
+                os.truncate(path, rows * np.dtype(dtype).itemsize)
+
+    def _stored_rows(self):
+        # A write interrupted part way leaves some columns longer; only whole rows count
+        return min(
+            os.path.getsize(self._column_path(name)) // np.dtype(dtype).itemsize if os.path.exists(self._column_path(name)) else 0
+            for name, dtype in COLUMNS.items()
+        )
+
+    def _refresh(self):
+        """Load rows appended since the last read and return the columns (caller holds the lock)"""
+        rows = self._stored_rows()
+
+        if rows > self._rows:
+            for name, dtype in COLUMNS.items():
+                buffer = self._buffers[name]
+                if rows > len(buffer):
+                    grown = np.empty(max(rows, 2 * len(buffer)), dtype=dtype)
+                    grown[:self._rows] = buffer[:self._rows]
+                    self._buffers[name] = buffer = grown
+                buffer[self._rows:rows] = np.fromfile(
+                    self._column_path(name), dtype=dtype, count=rows - self._rows, offset=self._rows * np.dtype(dtype).itemsize
+                )
+            # Strings are interned before the rows using them are written
+            self._read_strings()
+
+            questions = self._buffers["question"][self._rows:rows]
+            size = max(len(self._names["question"]), int(questions.max()) + 1)
+            self._question_answered = np.pad(self._question_answered, (0, size - len(self._question_answered)))
+            self._question_correct = np.pad(self._question_correct, (0, size - len(self._question_correct)))
+            self._question_answered += np.bincount(questions, minlength=size)
+            self._question_correct += np.bincount(questions, weights=self._buffers["correct"][self._rows:rows], minlength=size)
+            self._rows = rows
+
+        return {name: buffer[:self._rows] for name, buffer in self._buffers.items()}
+
+    def record_attempt(self, username, space_id, topic, difficulty, answers):
+        """Append one quiz attempt
+
+        answers is a list of dicts with question_id, answer (a letter or None),
+        correct (bool) and seconds spent on the question.
+        """
+        if not answers:
+            return
+        now = time.time()
+
+        with self._lock, file_lock(os.path.join(self.root, "history")):
+            self._drop_partial_rows()
+            columns = self._refresh()
+            attempt = int(columns["attempt"].max()) + 1 if len(columns["attempt"]) else 0
+            rows = {
+                "attempt": [attempt] * len(answers),
+                "user": [self._intern("user", username)] * len(answers),
+                "topic": [self._intern("topic", normalize_topic(topic))] * len(answers),
+                "space": [self._intern("space", space_id)] * len(answers),
+                "question": [self._intern("question", a["question_id"]) for a in answers],
+                "difficulty": [difficulty_index(difficulty)] * len(answers),
+                "answer": [ANSWER_LETTERS.find(a["answer"]) if a["answer"] else -1 for a in answers],
+                "correct": [int(bool(a["correct"])) for a in answers],
+                "seconds": [a["seconds"] for a in answers],
+                "ts": [now] * len(answers),
+            }
+            for name, dtype in COLUMNS.items():
+                with open(self._column_path(name), "ab") as f:
+                    np.asarray(rows[name], dtype=dtype).tofile(f)
+
+    def _user_rows(self, username, topic=None):
+        """Return the columns and a mask selecting one user's rows (and one topic's)"""
+        with self._lock:
+            columns = self._refresh()
+            user = self._strings["user"].get(username)
+            topic_id = self._strings["topic"].get(normalize_topic(topic)) if topic is not None else None
+
+        if user is None or (topic is not None and topic_id is None):
+            return columns, np.zeros(self._rows, dtype=bool)
+
+        mask = columns["user"] == user
+        if topic_id is not None:
+            mask &= columns["topic"] == topic_id
+        return columns, mask
+
+    def topic_accuracy(self, username):
+        """Return {topic: (answers, correct answers, accuracy)} for a user"""
+        columns, mask = self._user_rows(username)
+        topics = columns["topic"][mask]
+        if not len(topics):
+            return {}
+
+        answered = np.bincount(topics)
+        correct = np.bincount(topics, weights=columns["correct"][mask])
+        return {
+            self._names["topic"][t]: (int(answered[t]), int(correct[t]), float(correct[t] / answered[t]))
+            for t in np.flatnonzero(answered)
+        }
+
+    def question_difficulty(self, question_ids):
+        """Return {question_id: (answers, share answered correctly)} across all users"""
+        with self._lock:
+            self._refresh()
+            ids = {q: self._strings["question"][q] for q in question_ids if q in self._strings["question"]}
+            return {
+                q: (int(self._question_answered[i]), float(self._question_correct[i] / self._question_answered[i]))
+                for q, i in ids.items()
+                if i < len(self._question_answered) and self._question_answered[i]
+            }
+
+    def topic_trend(self, username, topic):
+        """Return the user's attempts on a topic, oldest first, as dicts with ts, difficulty and score"""
+        columns, mask = self._user_rows(username, topic)
+        if not mask.any():
+            return []
+
+        rows = np.flatnonzero(mask)
+        attempts, first, inverse = np.unique(columns["attempt"][rows], return_index=True, return_inverse=True)
+        scores = np.bincount(inverse, weights=columns["correct"][rows]) / np.bincount(inverse)
+        timestamps = columns["ts"][rows[first]]
+        levels = columns["difficulty"][rows[first]]
+        return [
+            {"ts": float(ts), "difficulty": DIFFICULTY_LEVELS[level], "score": float(score)}
+            for ts, level, score in zip(timestamps, levels, scores)
+        ]
+
+    def next_difficulty(self, username, topic, default):
+        """Choose the difficulty for the next quiz from the user's recent scores on the topic
+
+        Two strong recent attempts move the level up, a weak last attempt moves
+        it down, and with no history the default is kept.
+        """
+        trend = self.topic_trend(username, topic)
+        if not trend:
+            return default
+
+        level = difficulty_index(trend[-1]["difficulty"])
+        recent = [attempt["score"] for attempt in trend[-RECENT_ATTEMPTS:]]
+        if len(recent) == RECENT_ATTEMPTS and min(recent) >= STEP_UP_ACCURACY:
+            level = min(level + 1, len(DIFFICULTY_LEVELS) - 1)
+        elif recent[-1] < STEP_DOWN_ACCURACY:
+            level = max(level - 1, 0)
+        return DIFFICULTY_LEVELS[level]
+
+_history = None
+_history_lock = threading.Lock()
+
+def get_quiz_history():
+    """Return the process-wide attempt history in QUIZ_HISTORY_DIR"""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = QuizHistory(os.getenv("QUIZ_HISTORY_DIR", DEFAULT_HISTORY_DIR))
+        return _history
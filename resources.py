@@ -1,5 +1,6 @@
 import streamlit as st
-from utils import get_space_by_id, update_space, generate_learning_resources
+from utils import get_space_by_id, ensure_space_generation, display_generation_progress, watch_generation
+from blobstore import load_space_field
 
 def resources_view(space_id):
     """Display learning resources for the given space"""
@@ -26,23 +27,23 @@ def resources_view(space_id):
             st.rerun()
     
     # Check if resources exist or need to be generated
-    if not space.get('resources'):
-        with st.spinner("Gathering learning resources..."):
-            st.info("Finding the best learning resources for this topic.")
-            
-            # Generate resources
-            resources = generate_learning_resources(space['topic'])
-            
-            # Update space with resources
-            space['resources'] = resources
-            update_space(space)
-    
-    resources = space.get('resources', {})
-    
-    if not resources:
-        st.error("Failed to generate learning resources. Please try again later.")
+    if not load_space_field(space, 'resources'):
+        if 'resources' in space.get('failed_fields', []):
+            st.error("Failed to generate learning resources. Please try again later.")
+            if st.button("Try Again"):
+                ensure_space_generation(space, ['resources'])
+                st.rerun()
+            return
+        
+        # Gather resources in the background and pick them up on a later rerun
+        st.info("Finding the best learning resources for this topic.")
+        ensure_space_generation(space, ['resources'])
+        display_generation_progress(space)
+        watch_generation([space_id])
         return
     
+    resources = load_space_field(space, 'resources', {})
+    
     # Display resources
     display_resources(resources)
 
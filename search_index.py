@@ -0,0 +1,175 @@
+import os
+import re
+import time
+import threading
+from sections import split_sections
+from profiler import profiled
+from sqlite_store import SQLiteStore
+
+# Full-text search over everything generated for a user's spaces
+#
+# Each searchable piece (a content section, a resource, a quiz question or a
+# chat turn) is one row of a documents table, indexed by an SQLite FTS5 table
+# kept in step by triggers. A space's field is re-indexed whenever it is
+# generated or regenerated, so queries are a single ranked FTS lookup and
+# every hit carries what is needed to open the space at the matching place.
+# The owner's username is an FTS column too, so a query only ever matches and
+# ranks that user's documents, however many other users there are.
+
+DEFAULT_SEARCH_DB_PATH = "search_index.sqlite"
+# Matches in a document's title count this many times as much as in its body
+TITLE_WEIGHT = 5.0
+
+_WORD_RE = re.compile(r"\w+")
+
+def field_documents(field, value):
+    """Split a space field into (ref, title, body) documents"""
+    if not value:
+        return []
+
+    if field == "content":
+        return [(str(i), title, body) for i, (title, body) in enumerate(split_sections(value))]
+
+    if field == "resources":
+        return [
+            (f"{category}:{i}", item.get("title") or item.get("name", ""), " ".join(str(v) for v in item.values()))
+            for category, items in value.items()
+            for i, item in enumerate(items)
+            if isinstance(item, dict)
+        ]
+
+    if field == "quiz_questions":
+        return [
+            (str(i), q["question"], " ".join([q["question"]] + list(q.get("options", [])) + [q.get("explanation", "")]))
+            for i, q in enumerate(value)
+        ]
+
+    raise ValueError(f"Cannot index field {field}")
+
+def match_query(query, username=None):
+    """Turn free text into an FTS5 query that needs every word, the last one as a prefix, in one user's documents"""
+    words = _WORD_RE.findall(query.lower())
+    if not words:
+        return None
+    match = " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+    if username is None or not _WORD_RE.search(username):
+        return match
+    # Searched as a phrase of the username's tokens; the exact name is checked on the joined row
+    return 'username : "{}" AND ({})'.format(username.replace('"', '""'), match)
+
+class SearchIndex(SQLiteStore):
+    """FTS5 index of the documents in each user's learning spaces"""
+
+    def __init__(self, path=DEFAULT_SEARCH_DB_PATH):
+        super().__init__(path)
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    space_id TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    ref TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    body TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_space ON documents (space_id, kind, ref)")
+
+            # Indexes made before the username column was added are rebuilt with it
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(documents_fts)")]
+            rebuild = bool(columns) and "username" not in columns
+            if rebuild:
+                conn.execute("DROP TRIGGER IF EXISTS documents_insert")
+                conn.execute("DROP TRIGGER IF EXISTS documents_delete")
+                conn.execute("DROP TABLE documents_fts")
+
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+                    title, body, username, content='documents', content_rowid='id', tokenize='porter unicode61'
+                )
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS documents_insert AFTER INSERT ON documents BEGIN
+                    INSERT INTO documents_fts (rowid, title, body, username) VALUES (new.id, new.title, new.body, new.username);
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS documents_delete AFTER DELETE ON documents BEGIN
+                    INSERT INTO documents_fts (documents_fts, rowid, title, body, username) VALUES ('delete', old.id, old.title, old.body, old.username);
+                END
+            """)
+            if rebuild:
+                conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+            conn.execute("CREATE TABLE IF NOT EXISTS indexed_users (username TEXT PRIMARY KEY, indexed_at REAL NOT NULL)")
+
+    def index_field(self, username, space_id, topic, field, value):
+        """Replace the documents of one space field with its current value"""
+        documents = field_documents(field, value)
+        with self._connect() as conn:
+            conn.execute("DELETE FROM documents WHERE space_id = ? AND kind = ?", (space_id, field))
+            conn.executemany(
+                "INSERT INTO documents (username, space_id, topic, kind, ref, title, body) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(username, space_id, topic, field, ref, title, body) for ref, title, body in documents]
+            )
+
+    def index_chat_turn(self, username, space_id, topic, seq, question, answer):
+        """Add (or replace) the chat turn starting at message seq"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM documents WHERE space_id = ? AND kind = 'chat' AND ref = ?", (space_id, str(seq)))
+            conn.execute(
+                "INSERT INTO documents (username, space_id, topic, kind, ref, title, body) VALUES (?, ?, ?, 'chat', ?, ?, ?)",
+                (username, space_id, topic, str(seq), question, f"{question}\n{answer}")
+            )
+
+    def delete_space(self, space_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM documents WHERE space_id = ?", (space_id,))
+
+    def is_indexed(self, username):
+        """Whether the user's spaces from before the index existed have been added"""
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM indexed_users WHERE username = ?", (username,)).fetchone() is not None
+
+    def mark_indexed(self, username):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO indexed_users (username, indexed_at) VALUES (?, ?)", (username, time.time()))
+
+    @profiled("storage")
+    def search(self, username, query, limit=20):
+        """Return the user's best matching documents as dicts with space_id, topic, kind, ref, title and snippet"""
+        match = match_query(query, username)
+        if match is None:
+            return []
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT d.space_id, d.topic, d.kind, d.ref, d.title,
+                       snippet(documents_fts, 1, '**', '**', '…', 16)
+                FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid
+                WHERE documents_fts MATCH ? AND d.username = ?
+                ORDER BY bm25(documents_fts, {TITLE_WEIGHT}, 1.0, 0.0)
+                LIMIT ?
+                """,
+                (match, username, limit)
+            ).fetchall()
+
+        return [
+            # Snippets are shown inline, so markdown line structure is flattened
+            {"space_id": space_id, "topic": topic, "kind": kind, "ref": ref, "title": title, "snippet": " ".join(snippet.split())}
+            for space_id, topic, kind, ref, title, snippet in rows
+        ]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_search_index():
+    """Return the process-wide search index at SEARCH_DB_PATH"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex(os.getenv("SEARCH_DB_PATH", DEFAULT_SEARCH_DB_PATH))
+        return _index
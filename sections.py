@@ -0,0 +1,94 @@
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+import streamlit as st
+
+# Sectioned rendering of long generated content
+#
+# Learning content is split at its top-level headers into sections, and only
+# the section being read is sent to the browser. Parsing is cached per content
+# hash, so a rerun of a long space costs one hash and one section's markdown
+# instead of the whole document.
+
+PARSE_CACHE_SIZE = 128
+# Content shorter than this is shown in one piece
+MIN_SECTIONED_LENGTH = 3000
+
+_HEADER_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+
+_parsed = OrderedDict()
+_parsed_lock = threading.Lock()
+
+def _split(content):
+    """Split markdown at its highest-level headers (ignoring code blocks) into (title, body) pairs"""
+    lines = content.splitlines(keepends=True)
+    headers = []
+    in_fence = False
+    for i, line in enumerate(lines):
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        elif not in_fence:
+            match = _HEADER_RE.match(line)
+            if match:
+                headers.append((i, len(match.group(1)), match.group(2)))
+
+    # A single title header above everything else is not a section of its own
+    levels = [level for _, level, _ in headers]
+    while levels and levels.count(min(levels)) == 1 and len(set(levels)) > 1:
+        top = min(levels)
+        levels = [level for level in levels if level != top]
+    if not levels:
+        return [("Content", content)]
+
+    section_level = min(levels)
+    starts = [(i, title) for i, level, title in headers if level == section_level]
+    sections = []
+    if "".join(lines[:starts[0][0]]).strip():
+        sections.append(("Introduction", "".join(lines[:starts[0][0]])))
+    for (start, title), (end, _) in zip(starts, starts[1:] + [(len(lines), None)]):
+        sections.append((title, "".join(lines[start:end])))
+    return sections
+
+def split_sections(content):
+    """Return the (title, markdown) sections of content, parsing each distinct content once"""
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+    with _parsed_lock:
+        if digest in _parsed:
+            _parsed.move_to_end(digest)
+            return _parsed[digest]
+
+    sections = _split(content)
+    with _parsed_lock:
+        _parsed[digest] = sections
+        while len(_parsed) > PARSE_CACHE_SIZE:
+            _parsed.popitem(last=False)
+    return sections
+
+def _move_section(state_key, step):
+    st.session_state[state_key] += step
+
+@st.fragment
+def display_sections(content, key):
+    """Show long content one section at a time; changing section reruns only this fragment"""
+    sections = split_sections(content)
+    if len(sections) == 1 or len(content) < MIN_SECTIONED_LENGTH:
+        st.markdown(content)
+        return
+
+    state_key = f"section:{key}"
+    if st.session_state.get(state_key, 0) >= len(sections):
+        st.session_state[state_key] = 0
+
+    titles = [title for title, _ in sections]
+    st.selectbox("Section", range(len(sections)), format_func=titles.__getitem__, key=state_key)
+    index = st.session_state[state_key]
+
+    st.markdown(sections[index][1])
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("Previous section", key=f"{state_key}:previous", disabled=index == 0, on_click=_move_section, args=(state_key, -1))
+    with col2:
+        st.button("Next section", key=f"{state_key}:next", disabled=index == len(sections) - 1, on_click=_move_section, args=(state_key, 1))
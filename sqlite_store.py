@@ -0,0 +1,27 @@
+import sqlite3
+import threading
+
+# Base for the SQLite-backed stores
+#
+# SQLite connections cannot be shared between threads, and Streamlit runs each
+# session's script (and the background workers) on their own threads, so
+# every store keeps one connection per thread, opened on first use. Databases
+# are put in WAL mode so readers never wait on a writer.
+
+class SQLiteStore:
+    """One SQLite connection per thread to the database at path"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
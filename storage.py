@@ -0,0 +1,648 @@
+import os
+import re
+import sys
+import json
+import atexit
+import bisect
+import threading
+from profiler import profiled
+from sqlite_store import SQLiteStore
+
+# Storage backends for users and learning spaces
+#
+# Both backends expose the same row-level operations so utils.py does not need
+# to know which one is configured. JSONStorage keeps the original flat files;
+# SQLiteStorage indexes spaces by username and id so each operation only
+# touches the rows it needs. CachedStorage sits in front of either one and
+# keeps parsed spaces in memory until the backend reports a newer version,
+# and batches last_accessed updates through an AccessBuffer. A TopicIndex
+# lets the dashboard search and page through a user's spaces without
+# scanning every topic.
+
+DEFAULT_USERS = {"admin": "password"}
+SPACE_COLUMNS = ("id", "topic", "created_at", "last_accessed")
+SPACE_SORT_FIELDS = ("last_accessed", "created_at")
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+class JSONStorage:
+    """Stores users and spaces in users.json and user_spaces.json"""
+
+    def __init__(self, users_path="users.json", spaces_path="user_spaces.json"):
+        self.users_path = users_path
+        self.spaces_path = spaces_path
+        self._lock = threading.RLock()
+        # (spaces_version, parsed spaces file) shared by every user's reads
+        self._parsed = None
+
+    def load_users(self):
+        try:
+            with open(self.users_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Create default users file if it doesn't exist
+            default_users = dict(DEFAULT_USERS)
+            self.save_users(default_users)
+            return default_users
+
+    def save_users(self, users):
+        with open(self.users_path, "w") as f:
+            json.dump(users, f)
+
+    def get_password(self, username):
+        return self.load_users().get(username)
+
+    def add_user(self, username, password):
+        with self._lock:
+            users = self.load_users()
+            users[username] = password
+            self.save_users(users)
+
+    def load_spaces(self):
+        try:
+            with open(self.spaces_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Create empty spaces file if it doesn't exist
+            self.save_spaces({})
+            return {}
+
+    def save_spaces(self, spaces):
+        # Replace the file atomically so readers never see a partial write
+        # and every save gets a new inode for spaces_version to notice
+        tmp_path = f"{self.spaces_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(spaces, f)
+        os.replace(tmp_path, self.spaces_path)
+
+    def spaces_version(self, username):
+        """Return a token that changes whenever the spaces file is rewritten"""
+        try:
+            stat = os.stat(self.spaces_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _parsed_spaces(self):
+        """Return the parsed spaces file for reading, parsing it once per spaces_version"""
+        version = self.spaces_version(None)
+        parsed = self._parsed
+        if version is not None and parsed is not None and parsed[0] == version:
+            return parsed[1]
+
+        spaces = self.load_spaces()
+        self._parsed = (version, spaces)
+        return spaces
+
+    def get_spaces(self, username):
+        return self._parsed_spaces().get(username, [])
+
+    def get_space(self, username, space_id):
+        for space in self.get_spaces(username):
+            if space['id'] == space_id:
+                return space
+        return None
+
+    def add_space(self, username, space):
+        with self._lock:
+            spaces = self.load_spaces()
+            spaces.setdefault(username, []).append(space)
+            self.save_spaces(spaces)
+
+    def update_space(self, username, space):
+        with self._lock:
+            spaces = self.load_spaces()
+            for i, s in enumerate(spaces.get(username, [])):
+                if s['id'] == space['id']:
+                    spaces[username][i] = space
+                    self.save_spaces(spaces)
+                    return True
+        return False
+
+    def delete_space(self, username, space_id):
+        with self._lock:
+            spaces = self.load_spaces()
+            if username not in spaces:
+                return False
+            spaces[username] = [s for s in spaces[username] if s['id'] != space_id]
+            self.save_spaces(spaces)
+            return True
+
+    def touch_space(self, username, space_id, timestamp):
+        with self._lock:
+            spaces = self.load_spaces()
+            for space in spaces.get(username, []):
+                if space['id'] == space_id:
+                    space['last_accessed'] = timestamp
+                    self.save_spaces(spaces)
+                    return True
+        return False
+
+    def touch_spaces(self, touches):
+        """Apply many (username, space_id, timestamp) updates in one rewrite"""
+        with self._lock:
+            spaces = self.load_spaces()
+            for username, space_id, timestamp in touches:
+                for space in spaces.get(username, []):
+                    if space['id'] == space_id:
+                        space['last_accessed'] = timestamp
+                        break
+            self.save_spaces(spaces)
+
+class SQLiteStorage(SQLiteStore):
+    """Stores users and spaces in an SQLite database indexed by username and space id"""
+
+    def __init__(self, path="learning_tool.sqlite"):
+        super().__init__(path)
+
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT NOT NULL)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS spaces (
+                    id TEXT PRIMARY KEY,
+                    username TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    topic TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    last_accessed TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_spaces_username ON spaces (username, position)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS versions (username TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    @staticmethod
+    def _row_to_space(row):
+        space_id, topic, created_at, last_accessed, data = row
+        space = {"id": space_id, "topic": topic, "created_at": created_at, "last_accessed": last_accessed}
+        space.update(json.loads(data))
+        return space
+
+    @staticmethod
+    def _space_values(space):
+        data = {k: v for k, v in space.items() if k not in SPACE_COLUMNS}
+        return (space['topic'], space['created_at'], space['last_accessed'], json.dumps(data))
+
+    @staticmethod
+    def _bump_version(conn, username):
+        conn.execute(
+            "INSERT INTO versions (username, version) VALUES (?, 1) ON CONFLICT (username) DO UPDATE SET version = version + 1",
+            (username,)
+        )
+
+    def _bump_all_versions(self, conn):
+        for (username,) in conn.execute("SELECT DISTINCT username FROM spaces").fetchall():
+            self._bump_version(conn, username)
+
+    def spaces_version(self, username):
+        """Return a counter that is bumped by every write to this user's spaces"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT version FROM versions WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else 0
+
+    def is_migrated(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM meta WHERE name = 'migrated_from_json'").fetchone() is not None
+
+    def ensure_default_users(self):
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None:
+                conn.executemany("INSERT INTO users (username, password) VALUES (?, ?)", DEFAULT_USERS.items())
+
+    def load_users(self):
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT username, password FROM users").fetchall())
+
+    def save_users(self, users):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM users")
+            conn.executemany("INSERT INTO users (username, password) VALUES (?, ?)", users.items())
+
+    def get_password(self, username):
+        with self._connect() as conn:
+            row = conn.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, username, password):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO users (username, password) VALUES (?, ?)", (username, password))
+
+    def load_spaces(self):
+        spaces = {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT username, id, topic, created_at, last_accessed, data FROM spaces ORDER BY username, position"
+            ).fetchall()
+        for row in rows:
+            spaces.setdefault(row[0], []).append(self._row_to_space(row[1:]))
+        return spaces
+
+    def save_spaces(self, spaces):
+        with self._connect() as conn:
+            self._bump_all_versions(conn)
+            conn.execute("DELETE FROM spaces")
+            for username in spaces:
+                self._bump_version(conn, username)
+            conn.executemany(
+                "INSERT INTO spaces (id, username, position, topic, created_at, last_accessed, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (space['id'], username, position) + self._space_values(space)
+                    for username, user_spaces in spaces.items()
+                    for position, space in enumerate(user_spaces)
+                ]
+            )
+
+    def get_spaces(self, username):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, topic, created_at, last_accessed, data FROM spaces WHERE username = ? ORDER BY position",
+                (username,)
+            ).fetchall()
+        return [self._row_to_space(row) for row in rows]
+
+    def get_space(self, username, space_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, topic, created_at, last_accessed, data FROM spaces WHERE id = ? AND username = ?",
+                (space_id, username)
+            ).fetchone()
+        return self._row_to_space(row) if row else None
+
+    def add_space(self, username, space):
+        with self._connect() as conn:
+            position = conn.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM spaces WHERE username = ?", (username,)
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO spaces (id, username, position, topic, created_at, last_accessed, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (space['id'], username, position) + self._space_values(space)
+            )
+            self._bump_version(conn, username)
+
+    def update_space(self, username, space):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE spaces SET topic = ?, created_at = ?, last_accessed = ?, data = ? WHERE id = ? AND username = ?",
+                self._space_values(space) + (space['id'], username)
+            )
+            self._bump_version(conn, username)
+        return cursor.rowcount > 0
+
+    def delete_space(self, username, space_id):
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM spaces WHERE id = ? AND username = ?", (space_id, username))
+            self._bump_version(conn, username)
+        return cursor.rowcount > 0
+
+    def touch_space(self, username, space_id, timestamp):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE spaces SET last_accessed = ? WHERE id = ? AND username = ?", (timestamp, space_id, username)
+            )
+            self._bump_version(conn, username)
+        return cursor.rowcount > 0
+
+    def touch_spaces(self, touches):
+        """Apply many (username, space_id, timestamp) updates in one transaction"""
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE spaces SET last_accessed = ? WHERE id = ? AND username = ?",
+                [(timestamp, space_id, username) for username, space_id, timestamp in touches]
+            )
+            for username in {username for username, _, _ in touches}:
+                self._bump_version(conn, username)
+
+class AccessBuffer:
+    """Write-behind buffer that coalesces last_accessed updates
+
+    Touches are kept in memory (only the newest timestamp per space) and
+    written to the backend in one batch when flush_interval seconds have
+    passed, when max_pending spaces are waiting, or when the process exits.
+    """
+
+    def __init__(self, backend, flush_interval=5.0, max_pending=100):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing last accessed times: {str(e)}", file=sys.stderr)
+
+    def touch(self, username, space_id, timestamp):
+        with self._lock:
+            self._pending[(username, space_id)] = timestamp
+            full = len(self._pending) >= self.max_pending
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="access-buffer", daemon=True)
+                self._thread.start()
+
+        # Hand size-triggered flushes to the background thread so clicks never wait on them
+        if full:
+            self._wakeup.set()
+
+    def pending(self, username):
+        """Return {space_id: timestamp} for this user's unflushed touches"""
+        with self._lock:
+            return {space_id: timestamp for (user, space_id), timestamp in self._pending.items() if user == username}
+
+    def discard(self, username, space_id):
+        with self._lock:
+            self._pending.pop((username, space_id), None)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch = dict(self._pending)
+            if not batch:
+                return
+
+            self.backend.touch_spaces([(username, space_id, timestamp) for (username, space_id), timestamp in batch.items()])
+
+            # Keep anything touched again while the batch was being written
+            with self._lock:
+                for key, timestamp in batch.items():
+                    if self._pending.get(key) == timestamp:
+                        del self._pending[key]
+
+class TopicIndex:
+    """Per-user inverted index from topic words to space ids, with prefix lookup
+
+    Creating or deleting a space adds or removes only that space's words; a
+    user's index is built on their first search and brought up to date with
+    spaces written by other processes whenever their cached spaces reload.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._words = {}
+        self._topics = {}
+        self._synced = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _words_of(text):
+        return set(_WORD_RE.findall(text.lower()))
+
+    def _add(self, username, space_id, topic):
+        topics = self._topics[username]
+        if space_id in topics:
+            return
+        topics[space_id] = self._words_of(topic)
+
+        postings = self._postings[username]
+        for word in topics[space_id]:
+            if word not in postings:
+                postings[word] = set()
+                bisect.insort(self._words[username], word)
+            postings[word].add(space_id)
+
+    def _remove(self, username, space_id):
+        postings = self._postings[username]
+        for word in self._topics[username].pop(space_id, ()):
+            postings[word].discard(space_id)
+            if not postings[word]:
+                del postings[word]
+                words = self._words[username]
+                del words[bisect.bisect_left(words, word)]
+
+    def add(self, username, space_id, topic):
+        with self._lock:
+            if username in self._topics:
+                self._add(username, space_id, topic)
+
+    def remove(self, username, space_id):
+        with self._lock:
+            if username in self._topics:
+                self._remove(username, space_id)
+
+    def sync(self, username, spaces):
+        """Index any of the user's spaces that are missing and drop any that are gone"""
+        with self._lock:
+            if self._synced.get(username) is spaces:
+                return
+            if username not in self._topics:
+                self._postings[username] = {}
+                self._words[username] = []
+                self._topics[username] = {}
+
+            current = {space['id']: space['topic'] for space in spaces}
+            for space_id in self._topics[username].keys() - current.keys():
+                self._remove(username, space_id)
+            for space_id in current.keys() - self._topics[username].keys():
+                self._add(username, space_id, current[space_id])
+            self._synced[username] = spaces
+
+    def search(self, username, query):
+        """Return the ids of spaces with a topic word starting with every word of the query"""
+        with self._lock:
+            words = self._words.get(username, [])
+            postings = self._postings.get(username, {})
+            matches = None
+            for prefix in self._words_of(query):
+                found = set()
+                i = bisect.bisect_left(words, prefix)
+                while i < len(words) and words[i].startswith(prefix):
+                    found |= postings[words[i]]
+                    i += 1
+                matches = found if matches is None else matches & found
+                if not matches:
+                    break
+            return set(self._topics.get(username, {})) if matches is None else matches
+
+class CachedStorage:
+    """Read-through cache of each user's parsed spaces in front of a storage backend
+
+    Every read checks the backend's spaces_version (a stat call for JSON, one
+    indexed row for SQLite) and only re-reads the spaces when it has changed,
+    so repeated lookups within and across reruns are dictionary hits. The JSON
+    backend parses its file once per version for all users, so a write costs
+    one re-parse rather than one per user. Spaces
+    are handed out as shallow copies so callers can modify and save them
+    without touching the cached data.
+    """
+
+    def __init__(self, backend, access_buffer=None):
+        self.backend = backend
+        self.access_buffer = access_buffer or AccessBuffer(backend)
+        self.topic_index = TopicIndex()
+        self._spaces = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # User operations and anything else uncached go straight to the backend
+        return getattr(self.backend, name)
+
+    def _cached_spaces(self, username):
+        version = self.backend.spaces_version(username)
+        with self._lock:
+            cached = self._spaces.get(username)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        spaces = self.backend.get_spaces(username)
+        with self._lock:
+            self._spaces[username] = (version, spaces)
+        return spaces
+
+    def _invalidate(self, username=None):
+        with self._lock:
+            if username is None:
+                self._spaces.clear()
+            else:
+                self._spaces.pop(username, None)
+
+    def _with_pending_access(self, space, pending):
+        space = dict(space)
+        if space['id'] in pending:
+            space['last_accessed'] = pending[space['id']]
+        return space
+
+    @profiled("storage")
+    def get_spaces(self, username):
+        pending = self.access_buffer.pending(username)
+        return [self._with_pending_access(space, pending) for space in self._cached_spaces(username)]
+
+    @profiled("storage")
+    def get_space(self, username, space_id):
+        for space in self._cached_spaces(username):
+            if space['id'] == space_id:
+                return self._with_pending_access(space, self.access_buffer.pending(username))
+        return None
+
+    @profiled("storage")
+    def page_spaces(self, username, query="", sort="last_accessed", offset=0, limit=None):
+        """Return one page of a user's spaces, most recent first by sort, and how many match the topic query"""
+        if sort not in SPACE_SORT_FIELDS:
+            raise ValueError(f"Cannot sort spaces by {sort}")
+
+        spaces = self._cached_spaces(username)
+        if query.strip():
+            self.topic_index.sync(username, spaces)
+            ids = self.topic_index.search(username, query)
+            spaces = [space for space in spaces if space['id'] in ids]
+
+        pending = self.access_buffer.pending(username)
+        if sort == "last_accessed":
+            ordered = sorted(spaces, key=lambda space: pending.get(space['id'], space['last_accessed']), reverse=True)
+        else:
+            ordered = sorted(spaces, key=lambda space: space[sort], reverse=True)
+
+        page = ordered[offset:offset + limit] if limit else ordered[offset:]
+        return [self._with_pending_access(space, pending) for space in page], len(ordered)
+
+    @profiled("storage")
+    def save_spaces(self, spaces):
+        self.backend.save_spaces(spaces)
+        self._invalidate()
+
+    @profiled("storage")
+    def add_space(self, username, space):
+        self.backend.add_space(username, space)
+        self.topic_index.add(username, space['id'], space['topic'])
+        self._invalidate(username)
+
+    @profiled("storage")
+    def update_space(self, username, space):
+        updated = self.backend.update_space(username, space)
+        self._invalidate(username)
+        return updated
+
+    @profiled("storage")
+    def delete_space(self, username, space_id):
+        self.access_buffer.discard(username, space_id)
+        deleted = self.backend.delete_space(username, space_id)
+        self.topic_index.remove(username, space_id)
+        self._invalidate(username)
+        return deleted
+
+    @profiled("storage")
+    def touch_space(self, username, space_id, timestamp):
+        # Reads overlay pending touches, so the cached spaces stay valid
+        self.access_buffer.touch(username, space_id, timestamp)
+        return True
+
+def migrate_json_to_sqlite(json_storage, sqlite_storage):
+    """Copy users and spaces from the JSON files into the database (one-shot)"""
+    if sqlite_storage.is_migrated():
+        return False
+
+    users = {}
+    spaces = {}
+    if os.path.exists(json_storage.users_path):
+        users = json_storage.load_users()
+    if os.path.exists(json_storage.spaces_path):
+        spaces = json_storage.load_spaces()
+
+    with sqlite_storage._connect() as conn:
+        conn.executemany("INSERT OR REPLACE INTO users (username, password) VALUES (?, ?)", users.items())
+        for username, user_spaces in spaces.items():
+            conn.executemany(
+                "INSERT OR REPLACE INTO spaces (id, username, position, topic, created_at, last_accessed, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(space['id'], username, position) + sqlite_storage._space_values(space) for position, space in enumerate(user_spaces)]
+            )
+        sqlite_storage._bump_all_versions(conn)
+        conn.execute("INSERT INTO meta (name, value) VALUES ('migrated_from_json', datetime('now'))")
+
+    return True
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
+    """Return the process-wide storage backend selected by STORAGE_BACKEND"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            json_storage = JSONStorage(
+                users_path=os.getenv("USERS_PATH", "users.json"),
+                spaces_path=os.getenv("USER_SPACES_PATH", "user_spaces.json")
+            )
+
+            if os.getenv("STORAGE_BACKEND", "sqlite") == "json":
+                backend = json_storage
+            else:
+                backend = SQLiteStorage(os.getenv("STORAGE_PATH", "learning_tool.sqlite"))
+                # Existing installs carry their JSON data over the first time the database is used
+                migrate_json_to_sqlite(json_storage, backend)
+                backend.ensure_default_users()
+
+            access_buffer = AccessBuffer(
+                backend,
+                flush_interval=float(os.getenv("ACCESS_FLUSH_SECONDS", 5)),
+                max_pending=int(os.getenv("ACCESS_FLUSH_MAX_PENDING", 100))
+            )
+            _storage = CachedStorage(backend, access_buffer)
+        return _storage
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("Usage: python storage.py migrate")
+        sys.exit(1)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    json_storage = JSONStorage(
+        users_path=os.getenv("USERS_PATH", "users.json"),
+        spaces_path=os.getenv("USER_SPACES_PATH", "user_spaces.json")
+    )
+    sqlite_storage = SQLiteStorage(os.getenv("STORAGE_PATH", "learning_tool.sqlite"))
+
+    if migrate_json_to_sqlite(json_storage, sqlite_storage):
+        print(f"Migrated users and spaces into {sqlite_storage.path}")
+    else:
+        print(f"{sqlite_storage.path} has already been migrated")
@@ -1,15 +1,162 @@
 import os
+import sys
 import json
-import openai
 from datetime import datetime
 import streamlit as st
+import time
 import uuid
+import threading
+from llm_cache import get_llm_cache
+from llm_client import get_llm_client
+from model_router import get_model_router
+from metrics import get_llm_metrics
+from storage import get_storage
+from blobstore import pack_space, get_blob_store, load_space_field, HEAVY_FIELDS
+from jobs import get_job_queue
+from chat_context import build_chat_context, DEFAULT_CONTEXT_TOKENS
+from chat_store import get_chat_store
+from qa_cache import get_qa_cache, normalize_topic, shares_subject
+from json_stream import ObjectStream
+from question_bank import get_question_bank
+from search_index import get_search_index
+from prefetch import get_prefetcher
 
 # AI Functions
-def chat_with_ai(message, space_topic, customization=None):
-    if not customization:
-        customization = st.session_state.content_customization
+# Calls leave the model out so the client routes them through the task's
+# model tiers (model_router.py). Cached answers are keyed by the route and
+# only kept when the primary model gave them, so a fallback answer is never
+# served from the cache and changing MODEL_ROUTES starts afresh.
+
+def _primary_model(function, params):
+    """Model a call is attributed to in metrics when it never reached the API"""
+    return params.get("model") or get_model_router().models(function)[0]
+
+def _cache_key(cache, function, params):
+    """Key of a call's cached answer, including the model tiers of a routed call"""
+    if "model" not in params:
+        params = dict(params, route=get_model_router().models(function))
+    return cache.make_key(params)
+
+def _cached_completion(function, parse=None, **params):
+    """Return a completion's text (parsed if a parser is given), using the shared response cache
+    
+    function names the caller in the LLM metrics.
+    """
+    cache = get_llm_cache()
+    key = _cache_key(cache, function, params)
+    start = time.monotonic()
     
+    content = cache.get(key)
+    if content is not None:
+        get_llm_metrics().record(function, _primary_model(function, params), "cached", time.monotonic() - start)
+    else:
+        # Identical requests already in flight (from any session or worker) share one call
+        content, leader = cache.in_flight.do(key, lambda: _complete_and_cache(function, cache, key, params, parse))
+        if not leader:
+            get_llm_metrics().record(function, _primary_model(function, params), "coalesced", time.monotonic() - start)
+    
+    # Every caller parses its own copy so results are never shared between sessions
+    return parse(content) if parse else content
+
+def _complete_and_cache(function, cache, key, params, parse=None):
+    """Request a completion and cache its text"""
+    # A call for the same key may have finished between our cache miss and joining the flight
+    content = cache.get(key, count=False)
+    if content is not None:
+        return content
+    
+    served = {}
+    response = get_llm_client().create(function, served=served, **params)
+    content = response.choices[0].message.content
+    
+    # Parse before storing so malformed responses are never cached
+    if parse:
+        parse(content)
+    if not served.get("tier"):
+        cache.set(key, content)
+    
+    return content
+
+def _stream_completion(function, cache=False, validate=None, **params):
+    """Yield the text deltas of a streamed chat completion
+    
+    With cache, the full text is stored once it has arrived, provided validate
+    (if given) accepts it.
+    """
+    if not cache:
+        for chunk in get_llm_client().stream(function, **params):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        return
+    
+    llm_cache = get_llm_cache()
+    key = _cache_key(llm_cache, function, params)
+    
+    start = time.monotonic()
+    content = llm_cache.get(key)
+    if content is not None:
+        get_llm_metrics().record(function, _primary_model(function, params), "cached", time.monotonic() - start)
+        yield content
+        return
+    
+    # If the same completion is already being generated elsewhere, wait for it instead
+    flight, leader = llm_cache.in_flight.join(key)
+    if not leader:
+        content = llm_cache.in_flight.wait(flight)
+        get_llm_metrics().record(function, _primary_model(function, params), "coalesced", time.monotonic() - start)
+        yield content
+        return
+    
+    chunks = []
+    served = {}
+    try:
+        for chunk in get_llm_client().stream(function, served=served, **params):
+            if chunk.choices and chunk.choices[0].delta.content:
+                chunks.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        
+        content = "".join(chunks)
+        if validate:
+            validate(content)
+        if not served.get("tier"):
+            llm_cache.set(key, content)
+    except BaseException as e:
+        # Includes the stream being abandoned part way, so waiting callers are never left hanging
+        llm_cache.in_flight.finish(key, flight, error=e)
+        raise
+    
+    llm_cache.in_flight.finish(key, flight, content)
+
+def _summarize_chat(summary, messages):
+    """Fold chat messages that fell out of the context window into the running summary"""
+    transcript = "\n\n".join(f"{m['role'].title()}: {m['content']}" for m in messages)
+    
+    prompt = f"""
+    Update the summary of a tutoring conversation with the new exchanges below.
+    Keep the topics covered, the student's questions and anything they struggled with.
+    Stay under 200 words.
+    
+    Current summary:
+    {summary or "(none yet)"}
+    
+    New exchanges:
+    {transcript}
+    """
+    
+    response = get_llm_client().create(
+        "summarize_chat",
+        messages=[
+            {"role": "system", "content": "You summarize tutoring conversations concisely."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.3,
+        max_tokens=300
+    )
+    
+    return response.choices[0].message.content
+
+def _chat_messages(message, space_topic, customization, space_id=None):
+    """Build the message list for a tutoring question, including recent history"""
     # Prepare the message with customization settings
     system_message = f"""
     You are an expert tutor on the topic: {space_topic}.
@@ -22,21 +169,66 @@ def chat_with_ai(message, space_topic, customization=None):
     Use markdown formatting for better readability.
     """
     
-    try:
-        messages = [
-            {"role": "system", "content": system_message},
-        ]
+    messages = [
+        {"role": "system", "content": system_message},
+    ]
+    
+    budget = int(os.getenv("CHAT_CONTEXT_TOKENS", DEFAULT_CONTEXT_TOKENS))
+    
+    # Add as much recent chat history as fits the token budget, with older turns summarized
+    if space_id:
+        # Only the messages the stored summary does not cover yet need loading
+        chat_store = get_chat_store()
+        summary_state = chat_store.get_summary(space_id)
+        covered = summary_state['covered']
         
-        # Add chat history for context
-        if space_topic in st.session_state.chat_history:
-            messages.extend(st.session_state.chat_history[space_topic][-5:])  # Last 5 messages for context
+        messages.extend(build_chat_context(
+            chat_store.messages_from(space_id, covered),
+            summary_state,
+            _summarize_chat,
+            budget=budget,
+            offset=covered
+        ))
         
-        # Add the new user message
-        messages.append({"role": "user", "content": message})
+        if summary_state['covered'] != covered:
+            chat_store.save_summary(space_id, summary_state)
+    elif space_topic in st.session_state.chat_history:
+        summary_state = st.session_state.setdefault('chat_summaries', {}).setdefault(space_topic, {})
+        messages.extend(build_chat_context(
+            st.session_state.chat_history[space_topic],
+            summary_state,
+            _summarize_chat,
+            budget=budget
+        ))
+    
+    # Add the new user message
+    messages.append({"role": "user", "content": message})
+    
+    return messages
+
+def _record_chat_turn(space_topic, message, ai_response, space_id=None):
+    """Append a question and its answer to the space's stored history, or the session history"""
+    if space_id:
+        seq = get_chat_store().append_turn(space_id, message, ai_response)
+        _index_chat_turn(st.session_state.username, space_id, space_topic, seq, message, ai_response)
+        return
+    
+    if space_topic not in st.session_state.chat_history:
+        st.session_state.chat_history[space_topic] = []
+    
+    st.session_state.chat_history[space_topic].append({"role": "user", "content": message})
+    st.session_state.chat_history[space_topic].append({"role": "assistant", "content": ai_response})
+
+def chat_with_ai(message, space_topic, customization=None, space_id=None):
+    if not customization:
+        customization = st.session_state.content_customization
+    
+    try:
+        messages = _chat_messages(message, space_topic, customization, space_id)
         
         # Get response from OpenAI
-        response = openai.chat.completions.create(
-            model="gpt-4",  # You can change this to your preferred model
+        response = get_llm_client().create(
+            "chat_with_ai",
             messages=messages,
             temperature=0.7,
             max_tokens=1500
@@ -45,21 +237,76 @@ def chat_with_ai(message, space_topic, customization=None):
         ai_response = response.choices[0].message.content
         
         # Update chat history
-        if space_topic not in st.session_state.chat_history:
-            st.session_state.chat_history[space_topic] = []
-        
-        st.session_state.chat_history[space_topic].append({"role": "user", "content": message})
-        st.session_state.chat_history[space_topic].append({"role": "assistant", "content": ai_response})
+        _record_chat_turn(space_topic, message, ai_response, space_id)
+        get_qa_cache().add(space_topic, message, ai_response)
         
         return ai_response
         
     except Exception as e:
-        return f"Error communicating with AI: {str(e)}"
+        st.error(f"Error communicating with AI: {str(e)}")
+        return None
 
-def generate_learning_content(topic, customization=None):
+def stream_chat_with_ai(message, space_topic, customization=None, space_id=None):
+    """Streaming variant of chat_with_ai for use with st.write_stream"""
     if not customization:
         customization = st.session_state.content_customization
     
+    try:
+        messages = _chat_messages(message, space_topic, customization, space_id)
+        
+        chunks = []
+        for chunk in _stream_completion(
+            "chat_with_ai",
+            messages=messages,
+            temperature=0.7,
+            max_tokens=1500
+        ):
+            chunks.append(chunk)
+            yield chunk
+        
+        # Only record the turn once the full answer has arrived
+        _record_chat_turn(space_topic, message, "".join(chunks), space_id)
+        get_qa_cache().add(space_topic, message, "".join(chunks))
+        
+    except Exception as e:
+        st.error(f"Error communicating with AI: {str(e)}")
+
+def find_cached_answer(message, space_topic):
+    """Find a stored answer to a near-identical question on the same topic
+    
+    Returns a dict with the matched question, its answer, the similarity score
+    and whether it is close enough to use without asking, or None.
+    """
+    try:
+        match = get_qa_cache().lookup(space_topic, message, float(os.getenv("QA_OFFER_THRESHOLD", 0.6)))
+    except Exception:
+        return None
+    
+    if match is None:
+        return None
+    
+    score, question, answer = match
+    return {
+        "score": score,
+        "question": question,
+        "answer": answer,
+        # A match on the topic's name alone is only ever offered
+        "auto": score >= float(os.getenv("QA_AUTO_THRESHOLD", 0.9)) and shares_subject(message, question, space_topic)
+    }
+
+def warm_cached_answers(space_topic):
+    """Start loading a topic's stored answers in the background so its first question can match them"""
+    try:
+        get_qa_cache().warm(space_topic)
+    except Exception:
+        pass
+
+def use_cached_answer(message, space_topic, answer, space_id=None):
+    """Record a stored answer as the reply to a question"""
+    _record_chat_turn(space_topic, message, answer, space_id)
+
+def _learning_content_messages(topic, customization):
+    """Build the message list for a topic introduction"""
     prompt = f"""
     Create a comprehensive introduction to {topic} with these specifications:
     - Difficulty Level: {customization['difficulty_level']}
@@ -80,25 +327,45 @@ def generate_learning_content(topic, customization=None):
     - Bold or italic text for emphasis
     """
     
+    return [
+        {"role": "system", "content": "You are an educational content creator who specializes in creating engaging learning materials."},
+        {"role": "user", "content": prompt}
+    ]
+
+def generate_learning_content(topic, customization=None):
+    if not customization:
+        customization = st.session_state.content_customization
+    
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4",  # You can change this to your preferred model
-            messages=[
-                {"role": "system", "content": "You are an educational content creator who specializes in creating engaging learning materials."},
-                {"role": "user", "content": prompt}
-            ],
+        return _cached_completion(
+            "generate_learning_content",
+            messages=_learning_content_messages(topic, customization),
             temperature=0.7,
             max_tokens=2000
         )
         
-        return response.choices[0].message.content
-        
     except Exception as e:
-        return f"Error generating content: {str(e)}"
+        st.error(f"Error generating content: {str(e)}")
+        return None
 
-def generate_quiz_questions(topic, difficulty="intermediate", num_questions=5):
-    """Generate quiz questions for a given topic"""
+def stream_learning_content(topic, customization=None):
+    """Streaming variant of generate_learning_content for use with st.write_stream
+    
+    Errors are raised to the caller so a failed or partial answer is never saved as content.
+    """
+    if not customization:
+        customization = st.session_state.content_customization
     
+    yield from _stream_completion(
+        "generate_learning_content",
+        cache=True,
+        messages=_learning_content_messages(topic, customization),
+        temperature=0.7,
+        max_tokens=2000
+    )
+
+def _quiz_messages(topic, difficulty, num_questions, avoid=()):
+    """Build the message list for a quiz on a topic, steering away from the questions in avoid"""
     prompt = f"""
     Create {num_questions} quiz questions on the topic of "{topic}" at a {difficulty} difficulty level.
     
@@ -120,27 +387,94 @@ def generate_quiz_questions(topic, difficulty="intermediate", num_questions=5):
     ]
     """
     
+    if avoid:
+        avoided = "\n".join(f"- {question}" for question in avoid)
+        prompt += f"""
+    Do not repeat or rephrase any of these existing questions:
+    {avoided}
+    """
+    
+    return [
+        {"role": "system", "content": "You are an educational content creator skilled at creating assessment materials."},
+        {"role": "user", "content": prompt}
+    ]
+
+def _is_complete_question(question):
+    return isinstance(question, dict) and all(key in question for key in ("question", "options", "answer"))
+
+def generate_quiz_questions(topic, difficulty="intermediate", num_questions=5, avoid=()):
+    """Generate quiz questions for a given topic and add them to the question bank"""
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are an educational content creator skilled at creating assessment materials."},
-                {"role": "user", "content": prompt}
-            ],
+        questions = _cached_completion(
+            "generate_quiz_questions",
+            parse=json.loads,
+            messages=_quiz_messages(topic, difficulty, num_questions, avoid),
             temperature=0.7,
             max_tokens=2000,
             response_format={"type": "json_object"}
         )
         
-        content = response.choices[0].message.content
-        questions = json.loads(content)
-        
-        return questions.get("questions", []) if isinstance(questions, dict) else questions
+        questions = questions.get("questions", []) if isinstance(questions, dict) else questions
+        return get_question_bank().add(topic, difficulty, [q for q in questions if _is_complete_question(q)])
         
     except Exception as e:
         st.error(f"Error generating quiz: {str(e)}")
         return []
 
+def stream_quiz_questions(topic, difficulty="intermediate", num_questions=5):
+    """Yield quiz questions one by one as each is completed in the streamed response
+    
+    Uses the same request (and so the same cache entry) as generate_quiz_questions,
+    and adds each question to the question bank. Errors are raised to the caller.
+    """
+    parser = ObjectStream()
+    for delta in _stream_completion(
+        "generate_quiz_questions",
+        cache=True,
+        validate=json.loads,
+        messages=_quiz_messages(topic, difficulty, num_questions),
+        temperature=0.7,
+        max_tokens=2000,
+        response_format={"type": "json_object"}
+    ):
+        for question in parser.feed(delta):
+            # Skip anything that is not a complete question rather than showing a broken one
+            if _is_complete_question(question):
+                question.setdefault("explanation", "")
+                yield get_question_bank().add(topic, difficulty, [question])[0]
+
+def draw_quiz(topic, difficulty="intermediate", num_questions=5, exclude=()):
+    """Assemble a random quiz from the question bank without calling the LLM
+    
+    Questions whose ids are in exclude are only used when there are not enough
+    others. Returns None when the bank does not hold enough questions yet, and
+    tops the bank up in the background when it is running low.
+    """
+    bank = get_question_bank()
+    questions = bank.draw(topic, difficulty, num_questions, exclude)
+    if questions is not None and bank.count(topic, difficulty) < int(os.getenv("QUESTION_BANK_MIN", 15)):
+        _top_up_question_bank(topic, difficulty)
+    return questions
+
+def _top_up_question_bank(topic, difficulty):
+    """Queue generation of new questions for a topic unless a top-up is already running
+    
+    Top-ups are speculative, so they run within the prefetch caps and are
+    skipped (until the next draw) when those are reached.
+    """
+    queue = get_job_queue()
+    job_id = f"question-bank:{normalize_topic(topic)}:{difficulty}"
+    prefetcher = get_prefetcher()
+    if queue.is_queued(job_id, "top_up") or not prefetcher.try_acquire():
+        return
+    
+    bank = get_question_bank()
+    # Listing what the bank already holds makes the request (and its cache key) new each time
+    avoid = [q["question"] for q in bank.questions(topic, difficulty)][-30:]
+    top_up = lambda: generate_quiz_questions(topic, difficulty, int(os.getenv("QUESTION_BANK_TOP_UP", 10)), avoid)
+    if not queue.submit(job_id, {"top_up": _with_on_finish(top_up, prefetcher.release)}, lambda name, result, error: None):
+        prefetcher.release()
+
 def generate_learning_resources(topic):
     """Generate recommended learning resources for a topic"""
     
@@ -156,17 +490,18 @@ def generate_learning_resources(topic):
     
     Format the output as JSON with these categories:
     {{
-        "books": [{"title": "Book Title", "author": "Author Name", "description": "Brief description"}],
-        "courses": [{"platform": "Platform Name", "title": "Course Title", "link": "generic-url-placeholder", "description": "Brief description"}],
-        "videos": [{"channel": "Channel Name", "title": "Video Title", "description": "Brief description"}],
-        "websites": [{"name": "Website Name", "description": "What this site offers"}],
-        "communities": [{"name": "Community Name", "description": "What this community offers"}]
+        "books": [{{"title": "Book Title", "author": "Author Name", "description": "Brief description"}}],
+        "courses": [{{"platform": "Platform Name", "title": "Course Title", "link": "generic-url-placeholder", "description": "Brief description"}}],
+        "videos": [{{"channel": "Channel Name", "title": "Video Title", "description": "Brief description"}}],
+        "websites": [{{"name": "Website Name", "description": "What this site offers"}}],
+        "communities": [{{"name": "Community Name", "description": "What this community offers"}}]
     }}
     """
     
     try:
-        response = openai.chat.completions.create(
-            model="gpt-4",
+        resources = _cached_completion(
+            "generate_learning_resources",
+            parse=json.loads,
             messages=[
                 {"role": "system", "content": "You are a knowledgeable educator who knows about learning resources across many fields."},
                 {"role": "user", "content": prompt}
@@ -175,9 +510,6 @@ def generate_learning_resources(topic):
             max_tokens=1500,
             response_format={"type": "json_object"}
         )
-        
-        content = response.choices[0].message.content
-        resources = json.loads(content)
         return resources
         
     except Exception as e:
@@ -186,61 +518,316 @@ def generate_learning_resources(topic):
 
 # Data storage and retrieval functions
 def load_users():
-    try:
-        with open("users.json", "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Create default users file if it doesn't exist
-        default_users = {"admin": "password"}
-        with open("users.json", "w") as f:
-            json.dump(default_users, f)
-        return default_users
+    return get_storage().load_users()
 
 def save_users(users):
-    with open("users.json", "w") as f:
-        json.dump(users, f)
+    get_storage().save_users(users)
+
+def check_credentials(username, password):
+    """Check a login against the stored password for that user only"""
+    stored_password = get_storage().get_password(username)
+    return stored_password is not None and stored_password == password
+
+def register_user(username, password):
+    """Add a new user; returns False if the username is taken"""
+    storage = get_storage()
+    if storage.get_password(username) is not None:
+        return False
+    storage.add_user(username, password)
+    return True
 
 def load_user_spaces():
-    try:
-        with open("user_spaces.json", "r") as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Create empty spaces file if it doesn't exist
-        with open("user_spaces.json", "w") as f:
-            json.dump({}, f)
-        return {}
+    return get_storage().load_spaces()
 
 def save_user_spaces(spaces):
-    with open("user_spaces.json", "w") as f:
-        json.dump(spaces, f)
+    get_storage().save_spaces(spaces)
+
+def get_user_spaces(username):
+    """Get all spaces belonging to one user"""
+    return get_storage().get_spaces(username)
+
+def find_user_spaces(username, query="", sort="last_accessed", page=0, page_size=10):
+    """Get one page of a user's spaces matching a topic search, and how many match in total"""
+    return get_storage().page_spaces(username, query, sort, page * page_size, page_size)
+
+def _stream_quiz(topic, difficulty, on_partial):
+    """Generate a quiz, handing on_partial the questions received so far as each one completes"""
+    questions = []
+    for question in stream_quiz_questions(topic, difficulty):
+        questions.append(question)
+        on_partial(list(questions))
+    return questions
+
+def _generation_tasks(topic, customization, fields, on_partial=None):
+    """Map each requested space field to a callable that generates it
+    
+    With on_partial(field, value), the quiz is streamed and reported question by question.
+    """
+    difficulty = customization['difficulty_level'].lower()
+    generators = {
+        "content": lambda: generate_learning_content(topic, customization),
+        "resources": lambda: generate_learning_resources(topic),
+        # Popular topics get their quiz straight from the question bank
+        "quiz_questions": lambda: draw_quiz(topic, difficulty) or generate_quiz_questions(topic, difficulty),
+    }
+    if on_partial:
+        generators["quiz_questions"] = lambda: draw_quiz(topic, difficulty) or _stream_quiz(
+            topic, difficulty, lambda value: on_partial("quiz_questions", value)
+        )
+    return {field: generators[field] for field in fields}
+
+def _space_fields(include_quiz):
+    return ["content", "resources"] + (["quiz_questions"] if include_quiz else [])
+
+# Background generation
+# Serializes read-modify-write of space records between the script and the workers
+_generation_lock = threading.Lock()
+
+def _store_generated_field(username, space_id, field, value, error, customization=None):
+    """Save one background-generated field into its space and update the generation status"""
+    with _generation_lock:
+        storage = get_storage()
+        space = storage.get_space(username, space_id)
+        if space is None:
+            # The space was deleted while it was generating
+            return
+        
+        failed_fields = [f for f in space.get('failed_fields', []) if f != field]
+        if error is not None or not value:
+            failed_fields.append(field)
+            if field == "quiz_questions":
+                # Never report a quiz as available unless all of it was generated
+                space.pop('quiz_questions', None)
+                space.pop('quiz_questions_ref', None)
+                space['has_quiz'] = False
+        elif field == "content" and customization:
+            _add_content_variant(space, content_variant_key(customization), get_blob_store().put(value))
+        else:
+            space[field] = value
+            if field == "quiz_questions":
+                space['has_quiz'] = True
+        
+        space['failed_fields'] = failed_fields
+        space['pending_fields'] = [f for f in space.get('pending_fields', []) if f != field]
+        space['status'] = "pending" if space['pending_fields'] else "ready"
+        
+        storage.update_space(username, pack_space(space))
+    
+    if error is None and value:
+        _index_space_field(username, space_id, space['topic'], field, value)
+
+def _missing_field(space, field):
+    """Whether a space has no stored value for a field"""
+    if field == 'quiz_questions':
+        # Spaces created without a quiz may still store an empty question list
+        return not space.get('has_quiz')
+    return space.get(field) is None and f"{field}_ref" not in space
+
+def _with_on_finish(task, on_finish):
+    def run():
+        try:
+            return task()
+        finally:
+            on_finish()
+    return run
+
+def ensure_space_generation(space, fields, customization=None, on_finish=None):
+    """Queue background generation of the given space fields unless they are already queued
+    
+    Returns the fields that were queued; on_finish() is called as each of them finishes.
+    """
+    username = st.session_state.username
+    if not customization:
+        customization = st.session_state.content_customization
+    queue = get_job_queue()
+    
+    fields = [f for f in fields if not queue.is_queued(space['id'], f)]
+    if not fields:
+        return []
+    
+    # Mark the fields as pending before any worker can report back
+    with _generation_lock:
+        stored = get_storage().get_space(username, space['id'])
+        if stored is None:
+            return []
+        
+        # The caller's copy may predate a job that has stored some of the fields since
+        fields = [f for f in fields if f in stored.get('pending_fields', []) + stored.get('failed_fields', []) or _missing_field(stored, f)]
+        if fields:
+            stored['pending_fields'] = sorted(set(stored.get('pending_fields', [])) | set(fields))
+            stored['failed_fields'] = [f for f in stored.get('failed_fields', []) if f not in fields]
+            stored['status'] = "pending"
+            get_storage().update_space(username, pack_space(stored))
+    
+    for key in ('pending_fields', 'failed_fields', 'status'):
+        if key in stored:
+            space[key] = stored[key]
+    if not fields:
+        return []
+    
+    space_id = space['id']
+    tasks = _generation_tasks(
+        space['topic'],
+        customization,
+        fields,
+        # Parts are only kept in memory; the field is saved once it is complete
+        on_partial=lambda field, value: queue.notify(space_id, field, value)
+    )
+    if on_finish:
+        tasks = {field: _with_on_finish(task, on_finish) for field, task in tasks.items()}
+    # Another session may have queued some of the fields since the check above
+    return queue.submit(
+        space_id,
+        tasks,
+        lambda field, value, error: _store_generated_field(username, space_id, field, value, error, customization)
+    )
+
+# Speculative prefetch
+# Views the learner is likely to open next are generated ahead of the click,
+# within the caps in prefetch.py, and saved into the space like any other
+# generation, so the view finds them ready (or already streaming in).
+
+def _needs_field(space, field):
+    """Whether a field was never generated and is not being generated or marked failed"""
+    return _missing_field(space, field) and field not in space.get('pending_fields', []) and field not in space.get('failed_fields', [])
+
+def prefetch_space_fields(space, fields, customization=None):
+    """Start generating whichever of the fields are missing, if the prefetch caps allow"""
+    prefetcher = get_prefetcher()
+    granted = [field for field in fields if _needs_field(space, field) and prefetcher.try_acquire()]
+    if not granted:
+        return []
+    
+    queued = ensure_space_generation(space, granted, customization, on_finish=prefetcher.release)
+    # Fields someone else had already queued do not use a slot
+    for _ in range(len(granted) - len(queued)):
+        prefetcher.release()
+    return queued
+
+def prefetch_recent_resources(username):
+    """Fill in resources for the user's most recently accessed spaces that have none"""
+    recent, _ = get_storage().page_spaces(username, sort="last_accessed", limit=int(os.getenv("PREFETCH_RECENT_SPACES", 3)))
+    for space in recent:
+        if _needs_field(space, 'resources'):
+            prefetch_space_fields(space, ['resources'])
+
+# Content variants
+# Each space keeps the content generated for every customization it was viewed
+# with (difficulty, format and style), most recently used last, so switching
+# back to earlier settings needs no LLM call.
+
+def content_variant_key(customization):
+    return "|".join((customization['difficulty_level'], customization['content_format'], customization['learning_style']))
+
+def _variant_customization(key):
+    difficulty_level, content_format, learning_style = key.split("|")
+    return {'difficulty_level': difficulty_level, 'content_format': content_format, 'learning_style': learning_style}
+
+def _add_content_variant(space, key, ref, current=True):
+    """Record a content blob as the space's variant for key, evicting the least recently used over the limit"""
+    variants = dict(space.get('content_variants', {}))
+    variants.pop(key, None)
+    variants[key] = ref
+    
+    if current:
+        space.pop('content', None)
+        space['content_ref'] = ref
+        space['content_variant'] = key
+    
+    # Never evict the variant currently shown
+    limit = int(os.getenv("CONTENT_VARIANTS_PER_SPACE", 8))
+    evictable = [k for k in variants if k != space.get('content_variant')]
+    for k in evictable[:max(len(variants) - limit, 0)]:
+        del variants[k]
+    
+    space['content_variants'] = variants
 
-def create_learning_space(username, topic):
-    user_spaces = load_user_spaces()
+def get_content_variant(space, customization):
+    """Return the space's stored content for these settings, or None if it was never generated"""
+    ref = space.get('content_variants', {}).get(content_variant_key(customization))
+    return get_blob_store().get(ref) if ref else None
+
+def save_content_variant(space_id, customization, content=None):
+    """Make content the space's current content for these settings
     
-    if username not in user_spaces:
-        user_spaces[username] = []
+    Without content, the variant already stored for the settings is switched to.
+    """
+    username = st.session_state.username
+    key = content_variant_key(customization)
+    
+    with _generation_lock:
+        space = get_storage().get_space(username, space_id)
+        if space is None:
+            return False
+        
+        ref = get_blob_store().put(content) if content is not None else space.get('content_variants', {}).get(key)
+        if ref is None:
+            return False
+        _add_content_variant(space, key, ref)
+        updated = get_storage().update_space(username, pack_space(space))
+    
+    _index_space_field(username, space_id, space['topic'], 'content', content if content is not None else get_blob_store().get(ref))
+    return updated
+
+def _store_content_variant(username, space_id, key, content, error):
+    """Save a pre-generated variant without changing what the space shows"""
+    if error is not None or not content:
+        return
+    
+    with _generation_lock:
+        space = get_storage().get_space(username, space_id)
+        if space is None:
+            return
+        _add_content_variant(space, key, get_blob_store().put(content), current=False)
+        get_storage().update_space(username, pack_space(space))
+
+def prefetch_content_variants(space):
+    """Pre-generate the user's most used customizations for this space in the background
+    
+    Off unless CONTENT_VARIANT_PREFETCH sets how many variants to prepare.
+    """
+    count = int(os.getenv("CONTENT_VARIANT_PREFETCH", 0))
+    if not count:
+        return
     
+    # Popularity is how many of the user's spaces hold each variant
+    popularity = {}
+    for other in get_user_spaces(st.session_state.username):
+        for key in other.get('content_variants', {}):
+            popularity[key] = popularity.get(key, 0) + 1
+    
+    missing = [key for key in sorted(popularity, key=popularity.get, reverse=True) if key not in space.get('content_variants', {})]
+    if not missing[:count]:
+        return
+    
+    username = st.session_state.username
+    space_id = space['id']
+    topic = space['topic']
+    get_job_queue().submit(
+        f"{space_id}:variants",
+        {key: (lambda key=key: generate_learning_content(topic, _variant_customization(key))) for key in missing[:count]},
+        lambda key, content, error: _store_content_variant(username, space_id, key, content, error)
+    )
+
+def create_learning_space(username, topic, include_quiz=False):
+    """Save a pending space and queue its content, resources and optionally its quiz
+    
+    The fields are generated concurrently on the job queue and each is saved as
+    it finishes; one that fails is left out and listed in failed_fields.
+    """
     # Generate a unique ID for the space
     space_id = str(uuid.uuid4())
     
-    # Create the space
     new_space = {
         "id": space_id,
         "topic": topic,
         "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "last_accessed": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "content": generate_learning_content(topic),
-        "resources": generate_learning_resources(topic),
-        "has_quiz": False,
-        "quiz_questions": []
+        "status": "pending",
+        "has_quiz": False
     }
-    
-    user_spaces[username].append(new_space)
-    save_user_spaces(user_spaces)
-    
-    # Update session state
-    st.session_state.user_spaces = user_spaces
-    
+    get_storage().add_space(username, new_space)
+    ensure_space_generation(new_space, _space_fields(include_quiz))
     return space_id
 
 # UI Helper Functions
@@ -253,6 +840,11 @@ def display_space_card(space, index):
             st.write(f"**{space['topic']}**")
             st.caption(f"Created: {space['created_at']}")
             st.caption(f"Last accessed: {space['last_accessed']}")
+            
+            if space.get('status') == "pending":
+                # Pick generation back up if this process never queued it (e.g. after a restart)
+                ensure_space_generation(space, space.get('pending_fields', []))
+                display_generation_progress(space)
         
         with col2:
             if st.button("Learn", key=f"learn_{index}_{space['id']}"):
@@ -276,57 +868,119 @@ def display_space_card(space, index):
         
         st.divider()
 
+def load_partial_field(space, field, default=None):
+    """Return the part of a field generated so far by this process, while it is still generating"""
+    partial = get_job_queue().partial(space['id'], field)
+    return partial if partial is not None else default
+
+def display_generation_progress(space):
+    """Show how far background generation of a space has got"""
+    progress = get_job_queue().progress(space['id'])
+    done, total = progress if progress else (0, len(space.get('pending_fields', [])))
+    
+    st.progress(done / total if total else 0.0, text=f"Generating... {done}/{total} ready")
+
+@st.fragment(run_every=2)
+def rerun_on_generation_progress(space_ids, snapshot):
+    """Rerun the page once background generation for any of these spaces moves on"""
+    if [get_job_queue().version(space_id) for space_id in space_ids] != snapshot:
+        st.rerun()
+
+def watch_generation(space_ids):
+    """Keep polling while any of these spaces are generating, rerunning the page as results arrive"""
+    snapshot = [get_job_queue().version(space_id) for space_id in space_ids]
+    if any(progress is not None for progress in snapshot):
+        rerun_on_generation_progress(space_ids, snapshot)
+
 def update_space_last_accessed(space_id):
     """Update the last accessed time for a space"""
-    user_spaces = load_user_spaces()
-    username = st.session_state.username
-    
-    if username in user_spaces:
-        for space in user_spaces[username]:
-            if space['id'] == space_id:
-                space['last_accessed'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                break
-        
-        save_user_spaces(user_spaces)
+    get_storage().touch_space(st.session_state.username, space_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
 def delete_space(space_id):
     """Delete a learning space"""
-    user_spaces = load_user_spaces()
     username = st.session_state.username
     
-    if username in user_spaces:
-        # Remove the space from user's spaces
-        user_spaces[username] = [s for s in user_spaces[username] if s['id'] != space_id]
-        save_user_spaces(user_spaces)
+    if get_storage().delete_space(username, space_id):
+        get_chat_store().delete_space(space_id)
+        _unindex_space(space_id)
         
         # Update session state
-        st.session_state.user_spaces = user_spaces
+        st.session_state.user_spaces = {username: get_user_spaces(username)}
         if st.session_state.current_space == space_id:
             st.session_state.current_space = None
             st.session_state.space_view = None
     
 def get_space_by_id(space_id):
     """Get a space by its ID"""
-    user_spaces = load_user_spaces()
-    username = st.session_state.username
-    
-    if username in user_spaces:
-        for space in user_spaces[username]:
-            if space['id'] == space_id:
-                return space
-    
-    return None
+    return get_storage().get_space(st.session_state.username, space_id)
 
 def update_space(space):
     """Update a space in the storage"""
-    user_spaces = load_user_spaces()
+    return get_storage().update_space(st.session_state.username, pack_space(space))
+
+def update_space_fields(space_id, **fields):
+    """Set some fields of a space without overwriting anything written by background workers"""
     username = st.session_state.username
     
-    if username in user_spaces:
-        for i, s in enumerate(user_spaces[username]):
-            if s['id'] == space['id']:
-                user_spaces[username][i] = space
-                save_user_spaces(user_spaces)
-                return True
+    with _generation_lock:
+        space = get_storage().get_space(username, space_id)
+        if space is None:
+            return False
+        space.update(fields)
+        updated = get_storage().update_space(username, pack_space(space))
     
-    return False
+    for field in HEAVY_FIELDS:
+        if field in fields:
+            _index_space_field(username, space_id, space['topic'], field, fields[field])
+    return updated
+
+# Full-text search
+# Generated fields and chat turns are indexed as they are saved. Indexing
+# failures are logged rather than raised so they never lose generated content.
+
+def _index_space_field(username, space_id, topic, field, value):
+    try:
+        get_search_index().index_field(username, space_id, topic, field, value)
+    except Exception as e:
+        print(f"Error indexing {field} of {space_id}: {str(e)}", file=sys.stderr)
+
+def _index_chat_turn(username, space_id, topic, seq, question, answer):
+    try:
+        get_search_index().index_chat_turn(username, space_id, topic, seq, question, answer)
+    except Exception as e:
+        print(f"Error indexing chat of {space_id}: {str(e)}", file=sys.stderr)
+
+def _unindex_space(space_id):
+    try:
+        get_search_index().delete_space(space_id)
+    except Exception as e:
+        print(f"Error removing {space_id} from the search index: {str(e)}", file=sys.stderr)
+
+def _index_user_spaces(username):
+    """Index everything in a user's spaces once, covering spaces saved before search existed"""
+    index = get_search_index()
+    chat_store = get_chat_store()
+    for space in get_user_spaces(username):
+        for field in HEAVY_FIELDS:
+            index.index_field(username, space['id'], space['topic'], field, load_space_field(space, field))
+        
+        messages = chat_store.messages_from(space['id'], 0)
+        for seq in range(0, len(messages) - 1, 2):
+            index.index_chat_turn(username, space['id'], space['topic'], seq, messages[seq]['content'], messages[seq + 1]['content'])
+    index.mark_indexed(username)
+
+def search_spaces(query, limit=20):
+    """Find the parts of the current user's spaces matching a full-text query, best first"""
+    username = st.session_state.username
+    if not get_search_index().is_indexed(username):
+        _index_user_spaces(username)
+    return get_search_index().search(username, query, limit)
+
+def open_search_result(result):
+    """Open a space at the place a search result points to"""
+    st.session_state.current_space = result['space_id']
+    st.session_state.space_view = {"quiz_questions": "quiz", "resources": "resources"}.get(result['kind'], "content")
+    if result['kind'] == "content":
+        # Start the sectioned content view on the matching section
+        st.session_state[f"section:{result['space_id']}"] = int(result['ref'])
+    update_space_last_accessed(result['space_id'])